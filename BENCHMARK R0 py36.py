@@ -0,0 +1,292 @@
+'''
+Created on: see version log.
+@author: rigonz
+coding: utf-8
+
+IMPORTANT: requires py3.6 (rasterio)
+
+Script that:
+1) creates synthetic NL and PD raster files for several sizes of the common
+   grid (1e5 to 1e8 pixels), only once: they are kept in the benchmark
+   folder and are the same in every run (fixed seeds),
+2) runs the stages of the scripts on them (open, preflight, mask, read,
+   align, correlate, pearson, render), chunk by chunk, with the profiling of
+   nlpd_lib,
+3) compares the throughput (Mpixels/s) of each stage and the peak memory
+   with those of a stored baseline, and fails (exit code 1) if any of them
+   is worse than the tolerance. Each size runs in a new process, so its peak
+   memory does not include the creation of the files nor the other sizes.
+
+The synthetic files, the baseline and the charts are kept in RootDirBench
+(BENCH/ in the working folder, ignored by git; up to ~3 GB with 1e8).
+
+The synthetic files look like the real ones: bounds offset by a fraction of
+a pixel and by some pixels, resolutions of 15 and 30 arc-sec, no-data
+regions (a "sea" in a corner and scattered pixels, as the no-data value or as
+NaN), 0s and heavy-tailed values (log-normal). They need no input files; the
+real inputs are not required to measure whether a change of nlpd_lib makes
+things faster.
+
+Usage:
+python "BENCHMARK R0 py36.py"            compare with the baseline
+python "BENCHMARK R0 py36.py" --update   store the results as the baseline
+The baseline is only meaningful on the computer where it was stored.
+
+Version log.
+R0 (20261018):
+First trials, seems to work well.
+
+'''
+
+# %% Imports.
+import json
+import multiprocessing
+import os
+import platform
+import sys
+
+import rasterio  # IMPORTANT: requires py3.6
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # no windows, the charts are written to files
+from matplotlib import pyplot as plt
+
+import nlpd_lib as nl
+
+# %% Directories.
+RootDirBench = 'BENCH/'
+FileNameBaseline = RootDirBench + 'BASELINE.json'
+
+# %% Parameters.
+Sizes = [1e5, 1e6, 1e7]  # pixels of the common grid; add 1e8 for the full
+                         # run (about 3 GB of synthetic files)
+Repeats = 3              # the best of the repeats is kept
+ChunkRows = 256
+RangeNL = (-2., 4.)
+RangePD = (-3., 5.)
+Bins = 100
+TolSpeed = 0.25          # max. loss of throughput of a stage (fraction)
+TolMemory = 0.20         # max. increase of peak memory (fraction)
+MinTime = 0.1            # s; faster stages are not compared (noise)
+GdalCacheMB = 256        # fixed, so that the peak memory does not depend on
+                         # the RAM of the computer (GDAL uses 5% by default)
+UpdateBaseline = '--update' in sys.argv
+
+# Synthetic files: name, resolution (deg), offset of the top left corner
+# (pixels of 30 arc-sec, to the west and to the north), no-data as NaN:
+Specs = [('NL1', 1 / 240., 0.37, 0.21, False),
+         ('NL2', 1 / 120., 1.50, 0.73, False),
+         ('PD1', 1 / 120., 0.12, 2.40, False),
+         ('PD2', 1 / 240., 2.81, 0.55, True)]
+L0 = -10.  # top left corner of the common grid
+T0 = 44.
+
+
+# %% Functions.
+def f_SyntheticRaster(FileName, grid, seed, pd=False, nan=False, rows=1024):
+    '''
+    Function that:
+    - receives the file name, its Grid, the seed, the type (NL or PD) and the
+      kind of no-data (no-data value or NaN),
+    - writes the file chunk by chunk: heavy-tailed values, 20% of 0s, a "sea"
+      of no-data in the lower left corner and 2% of scattered no-data.
+    '''
+    rng = np.random.RandomState(seed)
+    nodata = -999.
+    with nl.f_CreateRaster(FileName, grid, 1, 'float32', nodata,
+                           **nl.f_TiledOptions()) as dst:
+        for i0, i1 in nl.f_Chunks(grid.h, rows):
+            if pd:
+                data = rng.lognormal(2., 2.5, (i1 - i0, grid.w))
+            else:
+                data = rng.lognormal(0., 2., (i1 - i0, grid.w))
+            data[rng.rand(i1 - i0, grid.w) < 0.20] = 0.
+            data[rng.rand(i1 - i0, grid.w) < 0.02] = nodata
+
+            # Sea: below the diagonal of the lower left corner:
+            y = np.arange(i0, i1)[:, None] / grid.h
+            x = np.arange(grid.w)[None, :] / grid.w
+            data[y - x > 0.6] = np.nan if nan else nodata
+            dst.write(data.astype('float32'), 1, window=nl.f_RowWindow(grid, i0, i1))
+
+
+def f_SyntheticFiles(size):
+    '''
+    Function that:
+    - receives the number of pixels of the common grid,
+    - creates the synthetic files and the region (GeoJSON) for that size,
+      if they do not exist,
+    - returns the NL file names, the PD file names and the region file name.
+    '''
+    res = 1 / 120.
+    h = int(np.sqrt(size * 3 / 4.))
+    w = int(size / h)
+    tag = '{:.0e}'.format(size)
+    FileNames = []
+    for k, (name, r, dx, dy, nan) in enumerate(Specs):
+        FileName = os.path.join(RootDirBench, 'SYN_{:s}_{:s}.tif'.format(tag, name))
+        FileNames.append(FileName)
+        if os.path.exists(FileName):
+            continue
+        print('Creating {:s}...'.format(FileName))
+        # Larger than the common grid, by some pixels to the right and bottom:
+        grid = nl.Grid(L0 - dx * res, T0 + dy * res, r, r,
+                       int(np.ceil((w + dx + 1 + k) * res / r)),
+                       int(np.ceil((h + dy + 2 + k) * res / r)))
+        f_SyntheticRaster(FileName, grid, 1000 * k + int(np.log10(size)),
+                          name[:2] == 'PD', nan)
+
+    # Region: octagon inside the grid:
+    FileNameRegion = os.path.join(RootDirBench, 'SYN_{:s}_REGION.geojson'.format(tag))
+    if not os.path.exists(FileNameRegion):
+        a = np.linspace(0., 2 * np.pi, 9)
+        xc, yc = L0 + w * res / 2, T0 - h * res / 2
+        ring = [[xc + 0.45 * w * res * np.cos(t), yc + 0.45 * h * res * np.sin(t)]
+                for t in a]
+        ring[-1] = ring[0]
+        with open(FileNameRegion, 'w') as f:
+            json.dump({'type': 'Polygon', 'coordinates': [ring]}, f)
+    return(FileNames[:2], FileNames[2:], FileNameRegion)
+
+
+def f_RunStages(FileNamesNL, FileNamesPD, FileNameRegion, FileNameChart):
+    '''
+    Function that:
+    - receives the NL and PD file names, the region and the chart file name,
+    - runs the stages of the scripts with the profiling enabled,
+    - returns the summary by stage (see nlpd_lib.f_ProfileSummary).
+    '''
+    nl.f_ProfileStart()
+    st = nl.f_StageStart('open')
+    ds_list = [rasterio.open(FileName) for FileName in FileNamesNL + FileNamesPD]
+    nl.f_StageEnd(st)
+
+    st = nl.f_StageStart('preflight')
+    grid = nl.f_CommonGrid(ds_list)
+    nl.f_StageEnd(st, grid.h * grid.w)
+
+    st = nl.f_StageStart('mask')
+    grid, mask = nl.f_Region(FileNameRegion, grid)  # no cache: timed
+    nl.f_StageEnd(st, grid.h * grid.w)
+
+    nNL = len(FileNamesNL)
+    mom = None
+    hist = None
+    for i0, i1 in nl.f_Chunks(grid.h, ChunkRows):
+        stack = nl.f_ReadStack(ds_list, grid, i0, i1, mask)  # read, align, mask
+        stack = stack.reshape(len(ds_list), -1)
+
+        st = nl.f_StageStart('correlate')
+        mom, hist = nl.f_PairMoments(stack[:nNL], stack[nNL:], RangeNL, RangePD,
+                                     Bins, mom, hist)
+        nl.f_StageEnd(st, stack.size)
+
+        # Reference, one pass per pair and per coefficient:
+        st = nl.f_StageStart('pearson')
+        for a in range(nNL):
+            for b in range(nNL, len(ds_list)):
+                nl.f_PearsonLE0(stack[a], stack[b])
+                nl.f_PearsonLT0(stack[a], stack[b])
+        nl.f_StageEnd(st, stack.shape[1] * nNL * (len(ds_list) - nNL))
+
+    st = nl.f_StageStart('render')
+    plt.pcolormesh(nl.f_HistEdges(RangeNL, Bins), nl.f_HistEdges(RangePD, Bins),
+                   hist[0, 0].T, cmap='binary')
+    plt.colorbar()
+    plt.savefig(FileNameChart, dpi=150)
+    plt.close()
+    nl.f_StageEnd(st, Bins * Bins)
+
+    for ds in ds_list:
+        ds.close()
+    return(nl.f_ProfileSummary(nl.f_ProfileStop()))
+
+
+def f_RunSize(size):
+    '''
+    Function that:
+    - receives the number of pixels of the common grid,
+    - runs the stages Repeats times on the synthetic files of that size,
+      keeping the best time of each stage,
+    - returns the stages and the peak memory of this process (MB); it is run
+      in a new process for each size, as the peak memory never goes down.
+    '''
+    if nl.f_PairMomentsNumba() is not None:
+        print('Compiling the kernel...')
+        nl.f_PairMoments(np.ones((1, 10)), np.ones((1, 10)), RangeNL, RangePD, Bins)
+
+    FileNamesNL, FileNamesPD, FileNameRegion = f_SyntheticFiles(size)
+    tag = '{:.0e}'.format(size)
+    FileNameChart = os.path.join(RootDirBench, 'SYN_{:s}_HEATMAP.png'.format(tag))
+    stages = {}
+    for rep in range(Repeats):
+        with rasterio.Env(GDAL_CACHEMAX=GdalCacheMB):
+            summary = f_RunStages(FileNamesNL, FileNamesPD, FileNameRegion,
+                                  FileNameChart)
+        for name, sp in summary.items():
+            best = stages.get(name)
+            if best is None or sp['wall_s'] < best['wall_s']:
+                stages[name] = {'wall_s': sp['wall_s'], 'pixels': sp['pixels'],
+                                'mpix_s': sp['pixels'] / max(sp['wall_s'], 1e-9) / 1e6}
+    return({'stages': stages, 'peak_rss_mb': nl.f_Usage()[1]})
+
+
+# %% Run.
+if __name__ == '__main__':
+    os.makedirs(RootDirBench, exist_ok=True)
+    results = {}
+    ctx = multiprocessing.get_context('spawn')
+    for size in Sizes:
+        f_SyntheticFiles(size)  # created here, out of the measured process
+        tag = '{:.0e}'.format(size)
+        print('Size {:s}...'.format(tag))
+        with ctx.Pool(1) as pool:
+            results[tag] = pool.apply(f_RunSize, (size,))
+        for name, sp in results[tag]['stages'].items():
+            print('{:10s} {:8.3f} s, {:9.2f} Mpixels/s.'.format(name, sp['wall_s'],
+                                                                 sp['mpix_s']))
+        print('Peak memory: {:7.1f} MB.'.format(results[tag]['peak_rss_mb']))
+
+    # %% Compare with the baseline.
+    bench = {'machine': platform.node(), 'python': platform.python_version(),
+             'numba': nl.f_PairMomentsNumba() is not None, 'sizes': results}
+    if UpdateBaseline or not os.path.exists(FileNameBaseline):
+        with open(FileNameBaseline, 'w') as f:
+            json.dump(bench, f, indent=1)
+        print('Baseline stored: {:s}'.format(FileNameBaseline))
+        regressions = []
+    else:
+        with open(FileNameBaseline) as f:
+            base = json.load(f)
+        if (base['machine'], base['numba']) != (bench['machine'], bench['numba']):
+            print('WARNING: the baseline was stored on another computer or setup.')
+
+        print('Comparing with the baseline ({:s})...'.format(FileNameBaseline))
+        regressions = []
+        for tag, res in results.items():
+            if tag not in base['sizes']:
+                continue
+            for name, sp in res['stages'].items():
+                bp = base['sizes'][tag]['stages'].get(name)
+                if bp is None or bp['wall_s'] < MinTime:
+                    continue
+                change = sp['mpix_s'] / bp['mpix_s'] - 1.
+                print('{:s} {:10s} {:+6.1%}'.format(tag, name, change))
+                if change < -TolSpeed:
+                    regressions.append('{:s} {:s}: {:.2f} Mpixels/s, baseline {:.2f}.'.format(
+                        tag, name, sp['mpix_s'], bp['mpix_s']))
+            mem = res['peak_rss_mb']
+            mem0 = base['sizes'][tag]['peak_rss_mb']
+            if mem0 > 0 and mem > mem0 * (1 + TolMemory):
+                regressions.append('{:s} peak memory: {:.1f} MB, baseline {:.1f} MB.'.format(
+                    tag, mem, mem0))
+
+    # %% Results.
+    for text in regressions:
+        print('WARNING: regression, ' + text)
+    print('Results: {:s}'.format('ERRORS' if regressions else 'OK'))
+    if regressions:
+        sys.exit(1)
+
+    # %% Script done.
+    print('\nScript completed. Thanks!')
@@ -0,0 +1,129 @@
+'''
+Created on: see version log.
+@author: rigonz
+coding: utf-8
+
+Script that:
+1) creates synthetic NL and PD bands (random, with no-data and 0s),
+2) computes the moments and histograms of all the pairs NL x PD with the
+   single-pass kernel (numba) and with its NumPy reference,
+3) checks that both give the same results, and the same Pearson coefficients
+   as f_PearsonLE0 and f_PearsonLT0,
+4) does the same with the pixels weighted by their area (weights of the
+   rows, see f_RowWeights), checked against np.cov with aweights.
+
+It needs no input files; it should be run after any change to
+nlpd_lib.f_PairMomentsKernel or f_PairMomentsNumPy.
+
+Version log.
+R0 (20261018):
+First trials, seems to work well.
+
+'''
+
+# %% Imports.
+import time
+
+import numpy as np
+
+import nlpd_lib as nl
+
+# %% Synthetic data.
+print('Creating the synthetic data...')
+rng = np.random.RandomState(20261018)
+n = 1000000
+nNL = 3
+nPD = 4
+RangeNL = (-2., 4.)
+RangePD = (-3., 5.)
+Bins = 100
+
+# Heavy-tailed values, with no-data (< 0), 0s and some values out of range:
+bNL = rng.lognormal(0., 2., (nNL, n))
+bPD = rng.lognormal(2., 2.5, (nPD, n))
+for b in (bNL, bPD):
+    b[rng.rand(*b.shape) < 0.05] = nl.NODATA
+    b[rng.rand(*b.shape) < 0.20] = 0.
+bNL[0, :10] = 10. ** RangeNL[1]  # right edge of the histogram
+
+# Weights of the rows: the n pixels are 1000 rows of a grid at 36-44 N:
+grid = nl.Grid(-10., 44., 1 / 120., 8 / 1000., n // 1000, 1000)
+wrow = nl.f_RowWeights(grid, 0, grid.h)
+
+# %% Compute.
+print('Computing with NumPy...')
+t0 = time.time()
+mom_np, hist_np = nl.f_PairMoments(bNL, bPD, RangeNL, RangePD, Bins,
+                                   use_numba=False)
+print('Time: {:6.3f} s.'.format(time.time() - t0))
+
+if nl.f_PairMomentsNumba() is None:
+    print('WARNING: numba is not available, the kernel is not checked.')
+    mom_nb, hist_nb = mom_np, hist_np
+else:
+    print('Computing with numba...')
+    nl.f_PairMoments(bNL[:, :10], bPD[:, :10], RangeNL, RangePD, Bins)  # compile
+    t0 = time.time()
+    mom_nb, hist_nb = nl.f_PairMoments(bNL, bPD, RangeNL, RangePD, Bins)
+    print('Time: {:6.3f} s.'.format(time.time() - t0))
+
+print('Computing with weights...')
+t0 = time.time()
+momw_np, histw_np = nl.f_PairMoments(bNL, bPD, RangeNL, RangePD, Bins,
+                                     use_numba=False, wrow=wrow)
+print('Time NumPy: {:6.3f} s.'.format(time.time() - t0))
+t0 = time.time()
+momw_nb, histw_nb = nl.f_PairMoments(bNL, bPD, RangeNL, RangePD, Bins,
+                                     wrow=wrow)
+print('Time: {:6.3f} s.'.format(time.time() - t0))
+
+# %% Check.
+print('Checking the results...')
+ok = True
+if not np.allclose(mom_nb, mom_np, rtol=1e-9, atol=0.):
+    print('WARNING: moments are not the same:')
+    print(np.abs(mom_nb - mom_np).max())
+    ok = False
+
+if not np.array_equal(hist_nb, hist_np):
+    print('WARNING: histograms are not the same:')
+    print(np.abs(hist_nb - hist_np).sum())
+    ok = False
+
+for a in range(nNL):
+    for b in range(nPD):
+        rLE = nl.f_PearsonLE0(bNL[a], bPD[b])
+        rLT = nl.f_PearsonLT0(bNL[a], bPD[b])
+        if (abs(nl.f_LinFit(mom_nb[a, b, 0])[2] - rLE) > 1e-9 or
+                abs(nl.f_LinFit(mom_nb[a, b, 1])[2] - rLT) > 1e-9):
+            print('WARNING: Pearson coeff. are not the same for NL{:d}-PD{:d}.'.format(a + 1, b + 1))
+            ok = False
+
+        # Histogram against np.histogram2d:
+        mask = (bNL[a] > 0) & (bPD[b] > 0)
+        h2d = np.histogram2d(np.log10(bNL[a, mask]), np.log10(bPD[b, mask]),
+                             bins=Bins, range=[RangeNL, RangePD])[0]
+        if np.abs(h2d - hist_nb[a, b]).sum() > 0.001 * h2d.sum():
+            print('WARNING: histogram differs from np.histogram2d for NL{:d}-PD{:d}.'.format(a + 1, b + 1))
+            ok = False
+
+# Weighted:
+if not (np.allclose(momw_nb, momw_np, rtol=1e-9, atol=0.) and
+        np.allclose(histw_nb, histw_np, rtol=1e-9, atol=1e-9)):
+    print('WARNING: weighted moments or histograms are not the same.')
+    ok = False
+
+wpix = np.repeat(wrow, grid.w)
+for a in range(nNL):
+    for b in range(nPD):
+        mask = (bNL[a] > 0) & (bPD[b] > 0)
+        c = np.cov(np.log10(bNL[a, mask]), np.log10(bPD[b, mask]),
+                   aweights=wpix[mask])
+        if abs(nl.f_LinFit(momw_nb[a, b, 1])[2] - c[0, 1] / np.sqrt(c[0, 0] * c[1, 1])) > 1e-9:
+            print('WARNING: weighted Pearson coeff. is not the same for NL{:d}-PD{:d}.'.format(a + 1, b + 1))
+            ok = False
+
+print('Results: {:s}'.format('OK' if ok else 'ERRORS'))
+
+# %% Script done.
+print('\nScript completed. Thanks!')
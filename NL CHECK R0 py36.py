@@ -30,7 +30,6 @@ The selection of the (right, bottom) corner is diffferent to POP CHECK.
 # %% Imports.
 import rasterio  # IMPORTANT: requires py3.6
 import numpy as np
-from matplotlib import pyplot as plt
 
 # %% Directories.
 RootDirIn = 'D:/0 DOWN/zz EXTSave/GIS/NIGHTLIGHT/SHP/'
@@ -40,18 +39,13 @@ FileNameI1 = RootDirIn + 'VNL_v2_npp_2019_global_vcmslcfg_c202102150000.median_m
 FileNameI2 = RootDirIn + 'F16_20100111-20110731_rad_v4.avg_vis_ESP_clip.tif'
 FileNameI3 = RootDirIn + 'F182013.v4c_web.avg_vis_ESP_clip.tif'
 
-# %% Read data.
-# Open files:
-print('Opening and reading the files...')
+# %% Open data.
+# Open files (read later, when the new bands are populated):
+print('Opening the files...')
 ds1 = rasterio.open(FileNameI1)
 ds2 = rasterio.open(FileNameI2)
 ds3 = rasterio.open(FileNameI3)
 
-# Read data:
-band1 = ds1.read(1)
-band2 = ds2.read(1)
-band3 = ds3.read(1)
-
 # %% Check the datasets.
 print('Checking the data...')
 # Bounds:
@@ -82,11 +76,11 @@ if ds1.indexes[0] != ds2.indexes[0] or ds1.indexes[0] != ds3.indexes[0]:
     print(ds3.indexes[0])
 
 # Dimensions:
-if band1.shape != band2.shape or band1.shape != band3.shape:
+if ds1.shape != ds2.shape or ds1.shape != ds3.shape:
     print('WARNING: shapes are not the same:')
-    print(band1.shape)
-    print(band2.shape)
-    print(band3.shape)
+    print(ds1.shape)
+    print(ds2.shape)
+    print(ds3.shape)
 
 # CRS:
 try:
@@ -108,10 +102,10 @@ res = 1 / 120.  # 30 arc-sec, approx 100 m; should be min() etc.
 right = left + (width - 1) * res
 bottom = top - (height - 1) * res
 
-# Check (valid for east + north hemispheres only!):
+# Check (x grows to the east and y to the north, in any hemisphere):
 if right > min(ds1.bounds.right, ds2.bounds.right, ds3.bounds.right):
     print('WARNING: right boundary exceeded.')
-if bottom > max(ds1.bounds.bottom, ds2.bounds.right, ds3.bounds.right):
+if bottom < max(ds1.bounds.bottom, ds2.bounds.bottom, ds3.bounds.bottom):
     print('WARNING: bottom boundary exceeded.')
 
 # Create new bands:
@@ -120,6 +114,12 @@ b1 = np.full((height, width), 0.)
 b2 = np.full((height, width), 0.)
 b3 = np.full((height, width), 0.)
 
+# Read data:
+print('Reading the files...')
+band1 = ds1.read(1)
+band2 = ds2.read(1)
+band3 = ds3.read(1)
+
 # Populate the new bands:
 count = 0
 for i in range(0, height, 1):
@@ -132,8 +132,8 @@ for i in range(0, height, 1):
         row, col = ds3.index(x, y)
         b3[i, j] = band3[row, col]
 
-    # Show the progress:
-    if count % height % 50 == 0:
+    # Show the progress (every 50 rows):
+    if count % 50 == 0:
         print('Progress... {:4.1f}%'.format(count/height*100))
     count += 1
 
@@ -160,6 +160,8 @@ print('DS1-3 = {:4.3f}.'.format(np.corrcoef(b1fm, b3fm)[0, 1]))
 print('DS2-3 = {:4.3f}.'.format(np.corrcoef(b2fm, b3fm)[0, 1]))
 
 # %% Draw histograms.
+from matplotlib import pyplot as plt  # imported only to draw the charts
+
 # Auxiliaries:
 color = ['k', 'r', 'b', 'g']
 label = ['DS1', 'DS2', 'DS3']
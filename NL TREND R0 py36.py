@@ -0,0 +1,135 @@
+'''
+Created on: see version log.
+@author: rigonz
+coding: utf-8
+
+IMPORTANT: requires py3.6 (rasterio)
+
+Script that:
+1) reads a series of yearly night-light raster files (a time series),
+2) fits a linear trend pixel by pixel and looks for change points,
+3) writes the results as raster files.
+
+The input data corresponds to a region of the world (ESP) and represents
+night light measures from satellites (NL), one file per year; NL CHECK uses
+the single file for 2019.
+
+The trend is the closed-form least squares fit of NL against the year,
+computed for all the pixels of a chunk of rows at once (no loop over pixels):
+slope (NL units / year), intercept (NL at the first year) and R2.
+No-data (< 0) is removed year by year, pixel by pixel.
+
+The change points compare, for each candidate break year, the single line to
+two lines (before / after) with an F statistic; the best candidate is kept.
+
+The growth hot spots are the pixels with slope >= SlopeMin, R2 >= R2Min and
+at least NMin valid years.
+
+The files are read, and the results written, chunk by chunk (ChunkRows rows
+of the common grid), so the memory used is ~ 10 x years x ChunkRows x width x
+8 bytes, whatever the size of the region.
+
+Version log.
+R0 (20261018):
+First trials, seems to work well.
+
+'''
+
+# %% Imports.
+import time
+
+import rasterio  # IMPORTANT: requires py3.6
+import numpy as np
+
+import nlpd_lib as nl
+
+# %% Directories.
+RootDirIn = 'D:/0 DOWN/zz EXTSave/GIS/NIGHTLIGHT/SHP/'
+RootDirOut = RootDirIn
+
+# Filenames, one per year (adapt the names of each release):
+Years = list(range(2012, 2024))
+FileNamesINL = [RootDirIn + 'VNL_v2_npp_{:d}_global_vcmslcfg_c202102150000.median_masked_ESP_clip.tif'.format(year)
+                for year in Years]
+
+FileNameOTrend = RootDirOut + 'NL_TREND_{:d}-{:d}_ESP.tif'.format(Years[0], Years[-1])
+FileNameOHot = RootDirOut + 'NL_HOTSPOTS_{:d}-{:d}_ESP.tif'.format(Years[0], Years[-1])
+
+# Region (GeoJSON polygon in EPSG:4326; None to use the whole files):
+FileNameRegion = None
+RootDirCache = RootDirOut + 'CACHE/'
+
+# %% Parameters.
+ChunkRows = 256   # rows of the common grid read at once
+SegMin = 3        # min. number of years of each segment for the change points
+FMin = 10.        # min. F statistic to flag a change point
+SlopeMin = 0.5    # min. slope of the hot spots, NL units / year
+R2Min = 0.5       # min. R2 of the hot spots
+NMin = 6          # min. number of valid years of the hot spots
+
+# %% Open data.
+print('Opening the NL files...')
+ds_list = [rasterio.open(FileName) for FileName in FileNamesINL]
+
+# Common grid, restricted to the region:
+grid = nl.f_CommonGrid(ds_list)
+grid, mask = nl.f_Region(FileNameRegion, grid, RootDirCache)
+print('Shape: w= {:4d} h= {:4d}'.format(grid.w, grid.h))
+
+# %% Compute the trends.
+print('Computing the trends...')
+dstT = nl.f_CreateRaster(FileNameOTrend, grid, 6, 'float32', np.nan,
+                         ['slope', 'intercept', 'R2', 'valid years',
+                          'change point F', 'change point year'])
+dstH = nl.f_CreateRaster(FileNameOHot, grid, 1, 'uint8', None,
+                         ['growth hot spot'])
+n_trend = 0
+sum_slope = 0.
+n_cp = 0
+n_hot = 0
+
+t_start = time.time()
+for i0, i1 in nl.f_Chunks(grid.h, ChunkRows):
+    stack = nl.f_ReadStack(ds_list, grid, i0, i1, mask)
+    cums = nl.f_TrendMoments(stack, Years)
+    tot = [c[-1] for c in cums]
+    slope, intercept, R2, _ = nl.f_TrendFit(*tot)
+    nv = tot[0]
+    F, y_cp = nl.f_ChangePoint(cums, Years, SegMin)
+
+    # Change points:
+    y_cp[F < FMin] = 0
+
+    # Hot spots:
+    hot = (slope >= SlopeMin) & (R2 >= R2Min) & (nv >= NMin)
+
+    # Write the chunk:
+    window = nl.f_RowWindow(grid, i0, i1)
+    for k, band in enumerate([slope, intercept, R2, nv, F, y_cp]):
+        dstT.write(band.astype('float32'), k + 1, window=window)
+    dstH.write(hot.astype('uint8'), 1, window=window)
+
+    # Summaries:
+    ok = np.isfinite(slope)
+    n_trend += int(ok.sum())
+    sum_slope += slope[ok].sum()
+    n_cp += int((y_cp > 0).sum())
+    n_hot += int(hot.sum())
+
+    # Show the progress:
+    print('Progress... {:4.1f}%'.format(i1 / grid.h * 100))
+
+dstT.close()
+dstH.close()
+print('Time: {:6.1f} s.'.format(time.time() - t_start))
+
+# %% Results.
+print('Results:')
+print('Pixels with a trend: {:d}'.format(n_trend))
+print('Mean slope: {:6.3f} NL/year'.format(sum_slope / max(n_trend, 1)))
+print('Pixels with a change point: {:d}'.format(n_cp))
+print('Pixels in growth hot spots: {:d}'.format(n_hot))
+print('Rasters: {:s}, {:s}'.format(FileNameOTrend, FileNameOHot))
+
+# %% Script done.
+print('\nScript completed. Thanks!')
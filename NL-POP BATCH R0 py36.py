@@ -0,0 +1,161 @@
+'''
+Created on: see version log.
+@author: rigonz
+coding: utf-8
+
+IMPORTANT: requires py3.6 (rasterio)
+
+Script that:
+1) reads a configuration file listing NL and PD datasets, regions and outputs
+   (see batch_example.yaml),
+2) finds, for each region, the pairs of datasets without statistics in the
+   results store (see NL-POP STATS),
+3) computes them in a pool of processes, one job per region, grid and NL
+   dataset (e.g. per region and year),
+4) keeps them in the results store and reports the throughput.
+
+It replaces the hand-edited copies of the scripts (one per country): the same
+datasets are used for all the regions. As in NL-POP STATS, the grid of a pair
+is the common grid of its own two files, so adding a dataset only computes its
+own pairs.
+
+The jobs of a region are sent together to the same process, which keeps the
+datasets open and a cache of the tiles of the common grid already read: the
+PD tiles are read once for all the NL datasets of a region, and the tiles of
+neighbouring regions are shared when they fall in the same process.
+
+Usage:
+python "NL-POP BATCH R0 py36.py" config.yaml
+(or set FileNameConfig below).
+
+Version log.
+R0 (20261018):
+First trials, seems to work well.
+
+'''
+
+# %% Imports.
+import multiprocessing
+import sys
+import time
+
+import rasterio  # IMPORTANT: requires py3.6
+
+import nlpd_lib as nl
+
+# %% Configuration.
+FileNameConfig = 'batch_example.yaml'
+
+
+# %% Functions.
+def f_RunBatch(FileNameConfig):
+    '''
+    Function that:
+    - receives the name of the configuration file,
+    - runs the jobs of the missing pairs of each region,
+    - prints the results and the throughput.
+    '''
+    cfg = nl.f_LoadConfig(FileNameConfig)
+    namesNL = list(cfg['nl'])
+    namesPD = list(cfg['pd'])
+    FileNamesNL = [cfg['nl'][name] for name in namesNL]
+    FileNamesPD = [cfg['pd'][name] for name in namesPD]
+    par = cfg['params']
+    RangeNL = tuple(par['range_nl'])
+    RangePD = tuple(par['range_pd'])
+    Bins = int(par['bins'])
+    CacheDir = cfg['output']['cache']
+
+    # Grid of each pair (common grid of its two files):
+    print('Opening the NL and PD files...')
+    grids = nl.f_PairGrids([rasterio.open(FileName) for FileName in FileNamesNL],
+                           [rasterio.open(FileName) for FileName in FileNamesPD])
+    print('Grids of the pairs: {:d}'.format(len(grids)))
+
+    # Hashes of the files:
+    print('Checking the results store...')
+    con = nl.f_OpenStore(cfg['output']['store'])
+    hNL = [nl.f_FileHash(con, FileName) for FileName in FileNamesNL]
+    hPD = [nl.f_FileHash(con, FileName) for FileName in FileNamesPD]
+
+    # Jobs of the missing pairs, by region, grid and NL dataset:
+    tasks = []
+    params = {}
+    for region, FileNameRegion in cfg['regions'].items():
+        jobs = []
+        for grid, pairs_grid in grids.items():
+            sub, mask = nl.f_Region(FileNameRegion, grid, CacheDir)
+            for a, b in pairs_grid:
+                params[region, a, b] = nl.f_ParamsKey(sub, mask, RangeNL,
+                                                      RangePD, Bins)
+            missing = [(a, b) for a, b in pairs_grid
+                       if nl.f_StoreGet(con, nl.f_PairKey(
+                           hNL[a], hPD[b], params[region, a, b])) is None]
+            for a in sorted(set(p[0] for p in missing)):
+                pairs = [p for p in missing if p[0] == a]
+                jobs.append({'region': region, 'FileNameRegion': FileNameRegion,
+                             'FileNamesNL': FileNamesNL,
+                             'FileNamesPD': FileNamesPD, 'pairs': pairs,
+                             'grid': grid, 'RangeNL': RangeNL,
+                             'RangePD': RangePD, 'Bins': Bins,
+                             'ChunkRows': int(par['chunk_rows']),
+                             'CacheDir': CacheDir})
+        if jobs:
+            tasks.append(jobs)
+    print('Regions: {:d}, jobs: {:d}'.format(len(cfg['regions']),
+                                             sum(len(jobs) for jobs in tasks)))
+
+    # Run the jobs; those of a region go together to the same process:
+    workers = int(par.get('workers', 0)) or multiprocessing.cpu_count()
+    workers = min(workers, max(len(tasks), 1))  # size of the pool
+    t0 = time.time()
+    pixels = {}  # pixels of each region (of the largest of its grids)
+    tiles = {}
+    if tasks:
+        pool = multiprocessing.Pool(workers, nl.f_InitBatchWorker,
+                                    (int(par.get('tile_cache', 256)),))
+        for res in (res for results in pool.imap_unordered(nl.f_BatchJobs, tasks)
+                    for res in results):
+            for a, b, mom, hist in res['results']:
+                pkey = params[res['region'], a, b]
+                nl.f_StorePut(con, nl.f_PairKey(hNL[a], hPD[b], pkey),
+                              hNL[a], hPD[b], pkey, mom, hist)
+            pixels[res['region']] = max(pixels.get(res['region'], 0),
+                                        res['pixels'])
+            tiles[res['pid']] = res['tiles']
+            print('{:s}: {:d} pairs in {:6.1f} s.'.format(
+                res['region'], len(res['results']), res['seconds']))
+        pool.close()
+        pool.join()
+    t = time.time() - t0
+
+    # Results:
+    print('Pearson coeff. after removing no-data / after removing 0s and no-data, LOG-LOG:')
+    for region in cfg['regions']:
+        for a in range(len(FileNamesNL)):
+            for b in range(len(FileNamesPD)):
+                mom, hist = nl.f_StoreGet(con, nl.f_PairKey(
+                    hNL[a], hPD[b], params[region, a, b]))
+                print('{:s} {:s}-{:s} = {:4.3f} / {:4.3f}.'.format(
+                    region, namesNL[a], namesPD[b], nl.f_LinFit(mom[0])[2],
+                    nl.f_LinFit(mom[1])[2]))
+    con.close()
+
+    # Throughput:
+    if tasks:
+        hits = sum(v['hits'] for v in tiles.values())
+        reads = sum(v['reads'] for v in tiles.values())
+        print('Throughput: {:d} workers, {:6.1f} s, {:8.3g} region pixels/s, {:6.1f} regions/hour.'.format(
+            workers, t, sum(pixels.values()) / t, len(tasks) / t * 3600))
+        print('Tiles: {:d} read, {:d} shared ({:4.1f}%).'.format(
+            reads, hits, 100. * hits / max(hits + reads, 1)))
+
+
+# %% Run.
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        FileNameConfig = sys.argv[1]
+    f_RunBatch(FileNameConfig)
+
+    # %% Script done.
+    print('\nScript completed. Thanks!')
@@ -0,0 +1,136 @@
+'''
+Created on: see version log.
+@author: rigonz
+coding: utf-8
+
+IMPORTANT: requires py3.6 (rasterio)
+
+Script that:
+1) reads the NL and PD raster files aligned to a common grid, chunk by chunk,
+2) counts, in a single pass, the no-data, 0s and positive values of each
+   dataset, and the joint combinations of all of them (contingency table),
+3) writes a coverage raster (bit k set if dataset k has data) and the
+   contingency table (CSV),
+4) fails (exit code 1) if the coverage is worse than the limits, so that it
+   can be run before the analytics (NL-POP CROSS, STATS...).
+
+The input data is the same as in NL-POP CROSS.
+
+NL CHECK and POP CHECK only report the differences of shape and bounds; the
+no-data of one source where the others have data, or the 0s of one source
+where the others are positive, are only seen here. The pixels out of a file
+are no-data, never 0.
+
+Version log.
+R0 (20261018):
+First trials, seems to work well.
+
+'''
+
+# %% Imports.
+import sys
+
+import rasterio  # IMPORTANT: requires py3.6
+import numpy as np
+
+import nlpd_lib as nl
+
+# %% Directories.
+# Filenames for NL:
+RootDirIn = 'D:/0 DOWN/zz EXTSave/GIS/NIGHTLIGHT/SHP/'
+FileNameINL1 = RootDirIn + 'VNL_v2_npp_2019_global_vcmslcfg_c202102150000.median_masked_ESP_clip.tif'
+FileNameINL2 = RootDirIn + 'F16_20100111-20110731_rad_v4.avg_vis_ESP_clip.tif'
+FileNameINL3 = RootDirIn + 'F182013.v4c_web.avg_vis_ESP_clip.tif'
+
+# Filenames for POP:
+RootDirIn = 'D:/0 DOWN/zz EXTSave/GIS/POP/EUR/SHP/'
+FileNameIPD1 = RootDirIn + 'WP/ESP_clip_pd_2020_1km_UNadj.tif'
+FileNameIPD2 = RootDirIn + 'WP/ESP_clip_ppp_2020_1km_Aggregated_UNadj_d.tif'
+FileNameIPD3 = RootDirIn + 'GPW/ESP_clip gpw_v4_population_density_rev11_2020_30_sec.tif'
+FileNameIPD4 = RootDirIn + 'GPW/ESP_clip gpw_v4_population_density_adjusted_to_2015_unwpp_country_totals_rev11_2020_30_sec.tif'
+
+# Output:
+RootDirOut = 'D:/0 DOWN/zz EXTSave/GIS/NIGHTLIGHT/OUT/'
+FileNameORas = RootDirOut + 'COVERAGE_ESP.tif'
+FileNameOTab = RootDirOut + 'COVERAGE_ESP.csv'
+
+# Region (GeoJSON polygon in EPSG:4326; None to use the whole files):
+FileNameRegion = None
+RootDirCache = RootDirOut + 'CACHE/'
+
+# %% Parameters.
+ChunkRows = 256     # rows of the common grid read at once
+Names = ['NL1', 'NL2', 'NL3', 'PD1', 'PD2', 'PD3', 'PD4']
+MaxNoData = 0.50    # max. share of no-data of a dataset
+MinJoint = 0.40     # min. share of pixels where all the datasets have data
+Classes = ['-', '0', '+']  # no-data, 0, positive
+
+# %% Open data.
+print('Opening the NL and PD files...')
+ds_list = [rasterio.open(FileName) for FileName in
+           (FileNameINL1, FileNameINL2, FileNameINL3,
+            FileNameIPD1, FileNameIPD2, FileNameIPD3, FileNameIPD4)]
+
+# Common grid, restricted to the region:
+grid = nl.f_CommonGrid(ds_list)
+grid, mask = nl.f_Region(FileNameRegion, grid, RootDirCache)
+print('Shape: w= {:4d} h= {:4d}'.format(grid.w, grid.h))
+
+# %% Count.
+print('Counting...')
+dst = nl.f_CreateRaster(FileNameORas, grid, 1, 'uint8', 0, ['coverage'],
+                        **nl.f_TiledOptions(predictor=1))
+counts = None
+table = None
+for i0, i1 in nl.f_Chunks(grid.h, ChunkRows):
+    stack = nl.f_ReadStack(ds_list, grid, i0, i1, mask)
+    counts, table, bits = nl.f_Coverage(
+        stack, counts, table, None if mask is None else mask[i0:i1])
+    dst.write(bits, 1, window=nl.f_RowWindow(grid, i0, i1))
+
+    # Show the progress:
+    print('Progress... {:4.1f}%'.format(i1 / grid.h * 100))
+dst.close()
+
+# %% Results.
+n = len(Names)
+total = counts[0].sum()
+print('Results ({:d} pixels):'.format(total))
+print('Dataset: no-data / 0s / positive.')
+for k, name in enumerate(Names):
+    print('{:s} = {:5.1%} / {:5.1%} / {:5.1%}.'.format(
+        name, *(counts[k] / max(total, 1))))
+
+# Contingency table, most frequent combinations first:
+records = []
+for code in np.argsort(table)[::-1]:
+    if table[code] == 0:
+        break
+    cls = nl.f_CoverageCode(code, n)
+    records.append((int(code),) + tuple(Classes[c] for c in cls)
+                   + (int(table[code]), table[code] / total))
+nl.f_WriteCSV(FileNameOTab, records, ['code'] + Names + ['pixels', 'share'])
+print('Most frequent combinations ({:s}):'.format(' '.join(Names)))
+for rec in records[:10]:
+    print('{:s} = {:5.1%}'.format(' '.join(' ' + c + ' ' for c in rec[1:n + 1]),
+                                  rec[-1]))
+print('Raster: {:s}'.format(FileNameORas))
+print('Table: {:d} combinations, {:s}'.format(len(records), FileNameOTab))
+
+# %% Check the limits.
+errors = []
+for k, name in enumerate(Names):
+    if counts[k, 0] > MaxNoData * total:
+        errors.append('{:s} has {:.1%} of no-data.'.format(name, counts[k, 0] / total))
+joint = sum(rec[-2] for rec in records if '-' not in rec[1:n + 1])
+if joint < MinJoint * total:
+    errors.append('all the datasets have data in {:.1%} of the pixels only.'.format(
+        joint / total))
+for text in errors:
+    print('WARNING: coverage, ' + text)
+print('Results: {:s}'.format('ERRORS' if errors else 'OK'))
+if errors:
+    sys.exit(1)
+
+# %% Script done.
+print('\nScript completed. Thanks!')
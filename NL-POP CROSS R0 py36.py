@@ -31,43 +31,45 @@ It also provides some charts for few pairs of data.
 
 It is based on the previous scripts, and improves some details.
 
+The files are read only where they intersect the common grid, chunk by chunk;
+optionally, the grid is restricted to a region (a GeoJSON polygon), so that
+unclipped global files can be used: only the windows of the files covering
+the region are read, and the pixels outside of it are removed as no-data.
+
+Optionally, the time (wall and CPU), bytes read, pixels and peak memory of
+each stage (open, preflight, read, align, mask, correlate, render) are
+recorded and written as a trace-event JSON file, that can be opened with
+chrome://tracing or https://ui.perfetto.dev.
+
+Optionally, the pixels are weighted by their area (AreaWeights): on the
+EPSG:4326 grid a pixel at 36 N covers more ground than one at 44 N, and the
+plain coefficients and heatmaps weigh them equally. The weights are the
+areas of the rows, broadcast along the rows.
+
+With Mode = 'preflight' the script only checks the files and finds the
+common grid; with Mode = 'stats' it stops after the correlations. matplotlib
+is only imported when the charts are drawn, so both modes start quickly.
+
 Version log.
 R0 (20210515):
 First trials, seems to work well.
+R1 (20261018):
+Files read chunk by chunk with nlpd_lib, optionally clipped to a region.
+Optional reprojection to an equal-area grid.
+Moments and heatmaps of all the pairs in a single pass (nlpd_lib).
+Optional profiling of the stages.
+Modes preflight and stats; matplotlib only imported for the charts.
+Optional weights by the area of the pixels.
 
 '''
 
 # %% Imports.
+import sys
+
 import rasterio  # IMPORTANT: requires py3.6
 import numpy as np
-from matplotlib import pyplot as plt
-
-
-# %% Functions.
-def f_PearsonLE0(b1faux, b2faux):
-    '''
-    Function that:
-    - receives two flattened arrays of the same shape,
-    - applies a mask to remove the negative values in any of the arrays,
-    - calculates the Pearson correlation coefficient to the masked pair,
-    - returns the coefficient.
-    '''
-    b_mask = np.array(np.array([b1faux, b2faux]).min(axis=0) < 0)
-    return(np.corrcoef(np.delete(b1faux, b_mask),
-                       np.delete(b2faux, b_mask))[0, 1])
-
-
-def f_PearsonLT0(b1faux, b2faux):
-    '''
-    Function that:
-    - receives two flattened arrays of the same shape,
-    - applies a mask to remove 0 and the negative values in any of the arrays,
-    - calculates the LOG-LOG Pearson correlation coefficient to the masked pair,
-    - returns the coefficient.
-    '''
-    b_mask = np.array(np.array([b1faux, b2faux]).min(axis=0) <= 0)
-    return(np.corrcoef(np.log10(np.delete(b1faux, b_mask)),
-                       np.log10(np.delete(b2faux, b_mask)))[0, 1])
+
+import nlpd_lib as nl
 
 # %% Directories.
 # Filenames for NL:
@@ -83,33 +85,54 @@ FileNameIPD2 = RootDirIn + 'WP/ESP_clip_ppp_2020_1km_Aggregated_UNadj_d.tif'
 FileNameIPD3 = RootDirIn + 'GPW/ESP_clip gpw_v4_population_density_rev11_2020_30_sec.tif'
 FileNameIPD4 = RootDirIn + 'GPW/ESP_clip gpw_v4_population_density_adjusted_to_2015_unwpp_country_totals_rev11_2020_30_sec.tif'
 
+# Region (GeoJSON polygon in EPSG:4326; None to use the whole files):
+FileNameRegion = None
+RootDirCache = 'D:/0 DOWN/zz EXTSave/GIS/NIGHTLIGHT/OUT/CACHE/'
+
+# Equal-area grid (None to keep EPSG:4326; 'auto' for a LAEA centred on the
+# data, valid in any hemisphere; 'EPSG:3035' for LAEA Europe) and its res.:
+EqualArea = None
+ResEA = 1000.  # m
+
+# Weights by the area of the pixels (None: all the same; 'cos': cos(lat);
+# 'ellipsoid': exact area on WGS84); not used with the equal-area grid:
+AreaWeights = None
+
+# Log10 ranges and bins of the heatmaps (fixed, to be filled chunk by chunk;
+# the pixels out of them are counted and reported, not drawn):
+RangeNL = (-2., 4.)
+RangePD = (-3., 5.)
+Bins = 100
+
+# Profile of the stages (trace-event JSON; None to disable the profiling):
+FileNameProfile = None
+# FileNameProfile = 'D:/0 DOWN/zz EXTSave/GIS/NIGHTLIGHT/OUT/PROFILE_NL-POP_CROSS.json'
+
+# Mode: 'all'; 'stats' (no charts); 'preflight' (checks and common grid only):
+Mode = 'all'
 
-# %% Read data.
-# Open NL files:
-print('Opening and reading the NL files...')
+
+# %% Open data.
+if FileNameProfile is not None:
+    nl.f_ProfileStart()
+st = nl.f_StageStart('open')
+
+# Open NL files (read later, chunk by chunk):
+print('Opening the NL files...')
 dsNL1 = rasterio.open(FileNameINL1)
 dsNL2 = rasterio.open(FileNameINL2)
 dsNL3 = rasterio.open(FileNameINL3)
 
-# Read NL data:
-bandNL1 = dsNL1.read(1)
-bandNL2 = dsNL2.read(1)
-bandNL3 = dsNL3.read(1)
-
 # Open PD files:
-print('Opening and reading the PD files...')
+print('Opening the PD files...')
 dsPD1 = rasterio.open(FileNameIPD1)
 dsPD2 = rasterio.open(FileNameIPD2)
 dsPD3 = rasterio.open(FileNameIPD3)
 dsPD4 = rasterio.open(FileNameIPD4)
-
-# Read PD data:
-bandPD1 = dsPD1.read(1)
-bandPD2 = dsPD2.read(1)
-bandPD3 = dsPD3.read(1)
-bandPD4 = dsPD4.read(1)
+nl.f_StageEnd(st)
 
 # %% Check the NL datasets.
+st = nl.f_StageStart('preflight')
 print('Checking the NL data...')
 # Bounds:
 if dsNL1.bounds != dsNL2.bounds or dsNL1.bounds != dsNL2.bounds:
@@ -139,11 +162,11 @@ if dsNL1.indexes[0] != dsNL2.indexes[0] or dsNL1.indexes[0] != dsNL3.indexes[0]:
     print(dsNL3.indexes[0])
 
 # Dimensions:
-if bandNL1.shape != bandNL2.shape or bandNL1.shape != bandNL3.shape:
+if dsNL1.shape != dsNL2.shape or dsNL1.shape != dsNL3.shape:
     print('WARNING: shapes are not the same:')
-    print(bandNL1.shape)
-    print(bandNL2.shape)
-    print(bandNL3.shape)
+    print(dsNL1.shape)
+    print(dsNL2.shape)
+    print(dsNL3.shape)
 
 # CRS:
 try:
@@ -213,55 +236,31 @@ except:
 
 # %% Create new bands.
 print('Checking the new bands...')
-# Remain within the boundaries of data:
-lNL1 = dsNL1.bounds.left
-lNL2 = dsNL2.bounds.left
-lNL3 = dsNL3.bounds.left
-tNL1 = dsNL1.bounds.top
-tNL2 = dsNL2.bounds.top
-tNL3 = dsNL3.bounds.top
-rNL1 = dsNL1.bounds.right
-rNL2 = dsNL2.bounds.right
-rNL3 = dsNL3.bounds.right
-bNL1 = dsNL1.bounds.bottom
-bNL2 = dsNL2.bounds.bottom
-bNL3 = dsNL3.bounds.bottom
-
-lPD1 = dsPD1.bounds.left
-lPD2 = dsPD2.bounds.left
-lPD3 = dsPD3.bounds.left
-lPD4 = dsPD4.bounds.left
-tPD1 = dsPD1.bounds.top
-tPD2 = dsPD2.bounds.top
-tPD3 = dsPD3.bounds.top
-tPD4 = dsPD4.bounds.top
-rPD1 = dsPD1.bounds.right
-rPD2 = dsPD2.bounds.right
-rPD3 = dsPD3.bounds.right
-rPD4 = dsPD4.bounds.right
-bPD1 = dsPD1.bounds.bottom
-bPD2 = dsPD2.bounds.bottom
-bPD3 = dsPD3.bounds.bottom
-bPD4 = dsPD4.bounds.bottom
-
-l = max(lNL1, lNL2, lNL3, lPD1, lPD2, lPD3, lPD4)
-t = min(tNL1, tNL2, tNL3, tPD1, tPD2, tPD3, tPD4)
-r = min(rNL1, rNL2, rNL3, rPD1, rPD2, rPD3, rPD4)
-b = max(bNL1, bNL2, bNL3, bPD1, bPD2, bPD3, bPD4)
-
-res = 1 / 120.  # 30 arc-sec, approx 100 m; should be min() etc.
-
-h = int(np.ceil((t - b) / res + 1))
-w = int(np.ceil((r - l) / res + 1))
-
-r_x = (r - l) / (w - 1)
-r_y = (t - b) / (h - 1)
+# Remain within the boundaries of data, and of the region:
+grid = nl.f_CommonGrid([dsNL1, dsNL2, dsNL3, dsPD1, dsPD2, dsPD3, dsPD4])
+grid, mask = nl.f_Region(FileNameRegion, grid, RootDirCache)
+
+l, t = nl.f_GridOrigin(grid)
+w = grid.w
+h = grid.h
+r_x = grid.r_x
+r_y = grid.r_y
+r = l + (w - 1) * r_x
+b = t - (h - 1) * r_y
 
 # Results:
 print('Results:')
 print('Boundaries: L= {:6.3f} T= {:6.3f} R= {:6.3f} B= {:6.3f}'.format(l, t, r, b))
 print('Resolution: x= {:8.6f} y= {:8.6f}'.format(r_x, r_y))
 print('Shape: w= {:4d} h= {:4d}'.format(w, h))
+nl.f_StageEnd(st)
+
+# %% Stop here in preflight mode.
+if Mode == 'preflight':
+    if FileNameProfile is not None:
+        nl.f_ProfileReport(FileNameProfile)
+    print('\nScript completed (preflight). Thanks!')
+    sys.exit()
 
 # %% New bands.
 # Create new bands:
@@ -276,23 +275,36 @@ bPD3 = np.full((h, w), 0.)
 bPD4 = np.full((h, w), 0.)
 
 # Populate the new bands:
-for i in range(0, h-1, 1):
-    for j in range(0, w-1, 1):
-        x, y = (l + j * r_x, t - i * r_y)
-        bNL1[i, j] = bandNL1[dsNL1.index(x, y)]
-        bNL2[i, j] = bandNL2[dsNL2.index(x, y)]
-        bNL3[i, j] = bandNL3[dsNL3.index(x, y)]
-
-        bPD1[i, j] = bandPD1[dsPD1.index(x, y)]
-        bPD2[i, j] = bandPD2[dsPD2.index(x, y)]
-        bPD3[i, j] = bandPD3[dsPD3.index(x, y)]
-        bPD4[i, j] = bandPD4[dsPD4.index(x, y)]
+ds_list = [dsNL1, dsNL2, dsNL3, dsPD1, dsPD2, dsPD3, dsPD4]
+for i0, i1 in nl.f_Chunks(h):
+    (bNL1[i0:i1], bNL2[i0:i1], bNL3[i0:i1],
+     bPD1[i0:i1], bPD2[i0:i1], bPD3[i0:i1], bPD4[i0:i1]) = nl.f_ReadStack(
+         ds_list, grid, i0, i1, mask)
 
     # Show the progress:
-    if (i % h) % 50 == 0:
-        print('Progress... {:4.1f}%'.format(i/h*100))
-
-# Flatten:
+    print('Progress... {:4.1f}%'.format(i1 / h * 100))
+
+# %% Equal-area grid (optional).
+# The pixels of EPSG:4326 shrink with the latitude; on an equal-area grid all
+# the pixels weigh the same. The table source -> target pixel is computed once
+# per pair of grids and kept in the cache folder.
+if EqualArea is not None:
+    st = nl.f_StageStart('reproject')
+    print('Reprojecting the new bands...')
+    crsEA, gridEA = nl.f_EqualAreaGrid(grid, EqualArea, ResEA)
+    lut = nl.f_ReprojectIndex(grid, crsEA, gridEA, RootDirCache)
+    bNL1 = nl.f_Reproject(bNL1, lut, gridEA)
+    bNL2 = nl.f_Reproject(bNL2, lut, gridEA)
+    bNL3 = nl.f_Reproject(bNL3, lut, gridEA)
+
+    bPD1 = nl.f_Reproject(bPD1, lut, gridEA)
+    bPD2 = nl.f_Reproject(bPD2, lut, gridEA)
+    bPD3 = nl.f_Reproject(bPD3, lut, gridEA)
+    bPD4 = nl.f_Reproject(bPD4, lut, gridEA)
+    print('Shape: w= {:4d} h= {:4d} ({:s})'.format(gridEA.w, gridEA.h, crsEA))
+    nl.f_StageEnd(st, bNL1.size * 7)
+
+# %% Flatten.
 bNL1f = bNL1.flatten()
 bNL2f = bNL2.flatten()
 bNL3f = bNL3.flatten()
@@ -302,37 +314,67 @@ bPD2f = bPD2.flatten()
 bPD3f = bPD3.flatten()
 bPD4f = bPD4.flatten()
 
+# %% Compute moments and histograms of all the pairs, in a single pass.
+# (nlpd_lib.f_PearsonLE0 and f_PearsonLT0 give the same coefficients, with
+# one pass per pair and per coefficient.)
+# The heatmaps are filled in the same pass: one stage, correlate.
+st = nl.f_StageStart('correlate')
+print('Computing the moments of all the pairs...')
+wrow = None
+if AreaWeights is not None and EqualArea is None:
+    print('Weights: area of the pixels ({:s}).'.format(AreaWeights))
+    wrow = nl.f_RowWeights(grid, 0, h, AreaWeights)
+mom, hist = nl.f_PairMoments(np.array([bNL1f, bNL2f, bNL3f]),
+                             np.array([bPD1f, bPD2f, bPD3f, bPD4f]),
+                             RangeNL, RangePD, Bins, wrow=wrow)
+eNL = nl.f_HistEdges(RangeNL, Bins)
+ePD = nl.f_HistEdges(RangePD, Bins)
+nl.f_StageEnd(st, bNL1f.size * 7)
+
 # %% Compute correlations by pairs of datasets, removing no-data.
 print('Pearson coeff. for the whole data after removing no-data:')
-print('NL1-PD1 = {:4.3f}.'.format(f_PearsonLE0(bNL1f, bPD1f)))
-print('NL1-PD2 = {:4.3f}.'.format(f_PearsonLE0(bNL1f, bPD2f)))
-print('NL1-PD3 = {:4.3f}.'.format(f_PearsonLE0(bNL1f, bPD3f)))
-print('NL1-PD4 = {:4.3f}.'.format(f_PearsonLE0(bNL1f, bPD4f)))
-print('NL2-PD1 = {:4.3f}.'.format(f_PearsonLE0(bNL2f, bPD1f)))
-print('NL2-PD2 = {:4.3f}.'.format(f_PearsonLE0(bNL2f, bPD2f)))
-print('NL2-PD3 = {:4.3f}.'.format(f_PearsonLE0(bNL2f, bPD3f)))
-print('NL2-PD4 = {:4.3f}.'.format(f_PearsonLE0(bNL2f, bPD4f)))
-print('NL3-PD1 = {:4.3f}.'.format(f_PearsonLE0(bNL3f, bPD1f)))
-print('NL3-PD2 = {:4.3f}.'.format(f_PearsonLE0(bNL3f, bPD2f)))
-print('NL3-PD3 = {:4.3f}.'.format(f_PearsonLE0(bNL3f, bPD3f)))
-print('NL3-PD4 = {:4.3f}.'.format(f_PearsonLE0(bNL3f, bPD4f)))
+for a in range(3):
+    for b in range(4):
+        print('NL{:d}-PD{:d} = {:4.3f}.'.format(a + 1, b + 1,
+                                                nl.f_LinFit(mom[a, b, 0])[2]))
 
 # %% Compute correlations by pairs of datasets, removing no-data, log-log.
 print('Pearson coeff. for the whole data after removing 0s and no-data, LOG-LOG:')
-print('NL1-PD1 = {:4.3f}.'.format(f_PearsonLT0(bNL1f, bPD1f)))
-print('NL1-PD2 = {:4.3f}.'.format(f_PearsonLT0(bNL1f, bPD2f)))
-print('NL1-PD3 = {:4.3f}.'.format(f_PearsonLT0(bNL1f, bPD3f)))
-print('NL1-PD4 = {:4.3f}.'.format(f_PearsonLT0(bNL1f, bPD4f)))
-print('NL2-PD1 = {:4.3f}.'.format(f_PearsonLT0(bNL2f, bPD1f)))
-print('NL2-PD2 = {:4.3f}.'.format(f_PearsonLT0(bNL2f, bPD2f)))
-print('NL2-PD3 = {:4.3f}.'.format(f_PearsonLT0(bNL2f, bPD3f)))
-print('NL2-PD4 = {:4.3f}.'.format(f_PearsonLT0(bNL2f, bPD4f)))
-print('NL3-PD1 = {:4.3f}.'.format(f_PearsonLT0(bNL3f, bPD1f)))
-print('NL3-PD2 = {:4.3f}.'.format(f_PearsonLT0(bNL3f, bPD2f)))
-print('NL3-PD3 = {:4.3f}.'.format(f_PearsonLT0(bNL3f, bPD3f)))
-print('NL3-PD4 = {:4.3f}.'.format(f_PearsonLT0(bNL3f, bPD4f)))
+for a in range(3):
+    for b in range(4):
+        print('NL{:d}-PD{:d} = {:4.3f}.'.format(a + 1, b + 1,
+                                                nl.f_LinFit(mom[a, b, 1])[2]))
+
+# Pixels out of the ranges of the heatmaps (counted in the log-log moments,
+# not drawn):
+for a in range(3):
+    for b in range(4):
+        n_out = mom[a, b, 1, 0] - hist[a, b].sum()
+        if n_out > 1e-9 * mom[a, b, 1, 0]:
+            print('WARNING: NL{:d}-PD{:d}, {:.2%} of the log-log pixels out of '
+                  'RangeNL / RangePD, not in the heatmap.'.format(
+                      a + 1, b + 1, n_out / mom[a, b, 1, 0]))
+
+# %% Zonal statistics: area with data and mean of each band.
+if wrow is not None:
+    print('Area with data (km2) and area-weighted mean:')
+    for name, band in (('NL1', bNL1), ('NL2', bNL2), ('NL3', bNL3),
+                       ('PD1', bPD1), ('PD2', bPD2), ('PD3', bPD3),
+                       ('PD4', bPD4)):
+        z = nl.f_ZonalMoments(band, wrow)[0]
+        print('{:s} = {:10.1f} / {:8.3f}.'.format(name, z[0], z[1] / z[0]))
+
+# %% Stop here in stats mode.
+if Mode == 'stats':
+    if FileNameProfile is not None:
+        nl.f_ProfileReport(FileNameProfile)
+    print('\nScript completed (stats). Thanks!')
+    sys.exit()
 
 # %% Draw chart - NOT Normalized, all.
+st = nl.f_StageStart('render')
+from matplotlib import pyplot as plt  # imported only to draw the charts
+
 # Auxiliaries:
 color = ['k', 'r', 'b', 'g']
 
@@ -350,15 +392,17 @@ plt.legend()
 plt.tight_layout()
 plt.ylim(0, 30000)
 plt.show()
+nl.f_StageEnd(st, bNL1f.size * 2)
 
 # %% Draw heatmap for best log-log correlation (NL1-PD1).
+st = nl.f_StageStart('render')
+
 # Plot:
-b_mask = np.array(np.array([bNL1f, bPD1f]).min(axis=0) <= 0)
-plt.hist2d(np.log10(np.delete(bNL1f, b_mask)), np.log10(np.delete(bPD1f, b_mask)), bins=100, cmap='binary')
+plt.pcolormesh(eNL, ePD, hist[0, 0].T, cmap='binary')
 
 # Colorbar:
 cb = plt.colorbar()
-cb.set_label('Number of entries')
+cb.set_label('Number of entries' if wrow is None else 'Area, km2')
 
 # Etc:
 plt.title('BEST', loc='right')
@@ -366,15 +410,17 @@ plt.xlabel('NL1, normalized, log10')
 plt.ylabel('PD1, normalized, log10')
 plt.tight_layout()
 plt.show()
+nl.f_StageEnd(st, Bins * Bins)
 
 # %% Draw heatmap for worst log-log correlation (NL1-PD3).
+st = nl.f_StageStart('render')
+
 # Plot:
-b_mask = np.array(np.array([bNL1f, bPD3f]).min(axis=0) <= 0)
-plt.hist2d(np.log10(np.delete(bNL1f, b_mask)), np.log10(np.delete(bPD3f, b_mask)), bins=100, cmap='binary')
+plt.pcolormesh(eNL, ePD, hist[0, 2].T, cmap='binary')
 
 # Colorbar:
 cb = plt.colorbar()
-cb.set_label('Number of entries')
+cb.set_label('Number of entries' if wrow is None else 'Area, km2')
 
 # Etc:
 plt.title('WORST', loc='right')
@@ -382,6 +428,11 @@ plt.xlabel('NL1, normalized, log10')
 plt.ylabel('PD3, normalized, log10')
 plt.tight_layout()
 plt.show()
+nl.f_StageEnd(st, Bins * Bins)
+
+# %% Profile of the stages.
+if FileNameProfile is not None:
+    nl.f_ProfileReport(FileNameProfile)
 
 # %% Script done.
 print('\nScript completed. Thanks!')
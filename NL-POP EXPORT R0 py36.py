@@ -0,0 +1,117 @@
+'''
+Created on: see version log.
+@author: rigonz
+coding: utf-8
+
+IMPORTANT: requires py3.6 (rasterio)
+
+Script that:
+1) reads the NL and PD raster files aligned to a common grid, chunk by chunk,
+2) writes the aligned data, so that it can be used without running the
+   scripts again:
+   - as a table (Parquet) of the valid pixels, with columns lon, lat,
+     NL1..NL3, PD1..PD4, for pandas and the like,
+   - as a multi-band GeoTIFF, for QGIS and the like.
+
+The input data is the same as in NL-POP CROSS, where the aligned bands bNL*
+and bPD* only exist during the session.
+
+A pixel is valid if any of the bands has data; the no-data of the other
+bands is written as NaN. Each chunk of rows is a row group of the Parquet
+file; the NumPy arrays are handed to Arrow without copies. Parquet requires
+the library pyarrow; without it, only the GeoTIFF is written.
+
+The GeoTIFF is tiled and compressed (deflate), the compression being done
+by all the CPUs in parallel threads.
+
+Version log.
+R0 (20261018):
+First trials, seems to work well.
+
+'''
+
+# %% Imports.
+import rasterio  # IMPORTANT: requires py3.6
+import numpy as np
+
+import nlpd_lib as nl
+
+# %% Directories.
+# Filenames for NL:
+RootDirIn = 'D:/0 DOWN/zz EXTSave/GIS/NIGHTLIGHT/SHP/'
+FileNameINL1 = RootDirIn + 'VNL_v2_npp_2019_global_vcmslcfg_c202102150000.median_masked_ESP_clip.tif'
+FileNameINL2 = RootDirIn + 'F16_20100111-20110731_rad_v4.avg_vis_ESP_clip.tif'
+FileNameINL3 = RootDirIn + 'F182013.v4c_web.avg_vis_ESP_clip.tif'
+
+# Filenames for POP:
+RootDirIn = 'D:/0 DOWN/zz EXTSave/GIS/POP/EUR/SHP/'
+FileNameIPD1 = RootDirIn + 'WP/ESP_clip_pd_2020_1km_UNadj.tif'
+FileNameIPD2 = RootDirIn + 'WP/ESP_clip_ppp_2020_1km_Aggregated_UNadj_d.tif'
+FileNameIPD3 = RootDirIn + 'GPW/ESP_clip gpw_v4_population_density_rev11_2020_30_sec.tif'
+FileNameIPD4 = RootDirIn + 'GPW/ESP_clip gpw_v4_population_density_adjusted_to_2015_unwpp_country_totals_rev11_2020_30_sec.tif'
+
+# Output:
+RootDirOut = 'D:/0 DOWN/zz EXTSave/GIS/NIGHTLIGHT/OUT/'
+FileNameOTab = RootDirOut + 'NL-PD_ESP.parquet'
+FileNameORas = RootDirOut + 'NL-PD_ESP.tif'
+
+# Region (GeoJSON polygon in EPSG:4326; None to use the whole files):
+FileNameRegion = None
+RootDirCache = RootDirOut + 'CACHE/'
+
+# %% Parameters.
+ChunkRows = 256  # rows of the common grid read at once; multiple of the tiles
+Names = ['NL1', 'NL2', 'NL3', 'PD1', 'PD2', 'PD3', 'PD4']
+
+# %% Open data.
+print('Opening the NL and PD files...')
+ds_list = [rasterio.open(FileName) for FileName in
+           (FileNameINL1, FileNameINL2, FileNameINL3,
+            FileNameIPD1, FileNameIPD2, FileNameIPD3, FileNameIPD4)]
+
+# Common grid, restricted to the region:
+grid = nl.f_CommonGrid(ds_list)
+grid, mask = nl.f_Region(FileNameRegion, grid, RootDirCache)
+print('Shape: w= {:4d} h= {:4d}'.format(grid.w, grid.h))
+
+# %% Export.
+print('Exporting...')
+if nl.f_Lazy('pyarrow.parquet') is None:
+    print('WARNING: pyarrow is not available, the Parquet file is not written.')
+    writer = None
+else:
+    writer = nl.f_ParquetWriter(FileNameOTab, ['lon', 'lat'] + Names)
+dst = nl.f_CreateRaster(FileNameORas, grid, len(Names), 'float32', np.nan,
+                        Names, **nl.f_TiledOptions())
+
+lon = nl.f_GridX(grid)
+count = 0
+for i0, i1 in nl.f_Chunks(grid.h, ChunkRows):
+    stack = nl.f_ReadStack(ds_list, grid, i0, i1, mask)
+    stack[stack < 0] = np.nan
+
+    # Raster:
+    dst.write(stack.astype('float32'), window=nl.f_RowWindow(grid, i0, i1))
+
+    # Table of the valid pixels:
+    if writer is not None:
+        i, j = np.nonzero(~np.isnan(stack).all(axis=0))
+        lat = nl.f_GridY(grid, i0, i1)[i]
+        nl.f_WriteParquet(writer, [lon[j], lat] + list(stack[:, i, j]))
+        count += i.size
+
+    # Show the progress:
+    print('Progress... {:4.1f}%'.format(i1 / grid.h * 100))
+
+dst.close()
+if writer is not None:
+    writer.close()
+
+# %% Results.
+print('Results:')
+print('Raster: {:d} bands, {:s}'.format(len(Names), FileNameORas))
+if writer is not None:
+    print('Table: {:d} valid pixels, {:s}'.format(count, FileNameOTab))
+
+# %% Script done.
+print('\nScript completed. Thanks!')
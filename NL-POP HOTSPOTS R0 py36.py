@@ -0,0 +1,134 @@
+'''
+Created on: see version log.
+@author: rigonz
+coding: utf-8
+
+IMPORTANT: requires py3.6 (rasterio)
+
+Script that:
+1) reads the NL and PD raster files aligned to a common grid, chunk by chunk,
+2) fits log10(NL) against log10(PD) for some pairs of datasets,
+3) finds the pixels where NL and PD disagree most (mismatch hot spots),
+4) writes them as CSV and GeoJSON files.
+
+The input data is the same as in NL-POP CROSS, and the pairs of interest are
+typically the best and the worst ones found there.
+
+The residual of a pixel is log10(NL + Off) - (a + b * log10(PD + Off)):
+- residual > 0: more light than expected for its population (lit but
+  uninhabited: airports, ports, industry, greenhouses...),
+- residual < 0: less light than expected (dark but dense).
+The offset Off keeps the 0s (a pixel with PD = 0 is the most interesting
+case of lit but uninhabited); no-data (< 0) is removed.
+
+The top-k residuals of each sign are found chunk by chunk with np.argpartition
+(O(n)) and merged into a bounded heap of k entries, so the memory used does
+not depend on the size of the region.
+
+Version log.
+R0 (20261018):
+First trials, seems to work well.
+
+'''
+
+# %% Imports.
+import rasterio  # IMPORTANT: requires py3.6
+import numpy as np
+
+import nlpd_lib as nl
+
+# %% Directories.
+# Filenames for NL:
+RootDirIn = 'D:/0 DOWN/zz EXTSave/GIS/NIGHTLIGHT/SHP/'
+FileNameINL1 = RootDirIn + 'VNL_v2_npp_2019_global_vcmslcfg_c202102150000.median_masked_ESP_clip.tif'
+FileNameINL2 = RootDirIn + 'F16_20100111-20110731_rad_v4.avg_vis_ESP_clip.tif'
+FileNameINL3 = RootDirIn + 'F182013.v4c_web.avg_vis_ESP_clip.tif'
+
+# Filenames for POP:
+RootDirIn = 'D:/0 DOWN/zz EXTSave/GIS/POP/EUR/SHP/'
+FileNameIPD1 = RootDirIn + 'WP/ESP_clip_pd_2020_1km_UNadj.tif'
+FileNameIPD2 = RootDirIn + 'WP/ESP_clip_ppp_2020_1km_Aggregated_UNadj_d.tif'
+FileNameIPD3 = RootDirIn + 'GPW/ESP_clip gpw_v4_population_density_rev11_2020_30_sec.tif'
+FileNameIPD4 = RootDirIn + 'GPW/ESP_clip gpw_v4_population_density_adjusted_to_2015_unwpp_country_totals_rev11_2020_30_sec.tif'
+
+# Output (completed with the pair and the extension):
+RootDirOut = 'D:/0 DOWN/zz EXTSave/GIS/NIGHTLIGHT/OUT/'
+FileNameO = RootDirOut + 'HOTSPOTS_ESP_'
+
+# Region (GeoJSON polygon in EPSG:4326; None to use the whole files):
+FileNameRegion = None
+RootDirCache = RootDirOut + 'CACHE/'
+
+# %% Parameters.
+Pairs = [(1, 1), (1, 3)]  # (NL, PD): best and worst log-log in NL-POP CROSS
+K = 1000         # number of hot spots of each sign
+Off = 1.         # offset of the log, keeps the 0s
+ChunkRows = 256  # rows of the common grid read at once
+
+# %% Open data.
+print('Opening the NL and PD files...')
+dsNL = [rasterio.open(FileName) for FileName in
+        (FileNameINL1, FileNameINL2, FileNameINL3)]
+dsPD = [rasterio.open(FileName) for FileName in
+        (FileNameIPD1, FileNameIPD2, FileNameIPD3, FileNameIPD4)]
+
+# Common grid, restricted to the region:
+grid = nl.f_CommonGrid(dsNL + dsPD)
+grid, mask = nl.f_Region(FileNameRegion, grid, RootDirCache)
+print('Shape: w= {:4d} h= {:4d}'.format(grid.w, grid.h))
+
+# Only the datasets of the pairs are read:
+iNL = sorted(set(p[0] for p in Pairs))
+iPD = sorted(set(p[1] for p in Pairs))
+ds_list = [dsNL[n - 1] for n in iNL] + [dsPD[n - 1] for n in iPD]
+
+# %% Fit log10(NL) against log10(PD), first pass.
+print('Fitting the pairs...')
+mom = {pair: np.zeros(6) for pair in Pairs}
+for i0, i1 in nl.f_Chunks(grid.h, ChunkRows):
+    stack = nl.f_ReadStack(ds_list, grid, i0, i1, mask)
+    for pair in Pairs:
+        mom[pair] += nl.f_Moments(*nl.f_StackPair(stack, pair, iNL, iPD, Off))
+
+fit = {pair: nl.f_LinFit(mom[pair]) for pair in Pairs}
+for pair in Pairs:
+    print('NL{:d}-PD{:d}: a= {:6.3f} b= {:6.3f} r= {:4.3f}'.format(
+        pair[0], pair[1], *fit[pair]))
+
+# %% Find the hot spots, second pass.
+print('Finding the hot spots...')
+heap_pos = {pair: [] for pair in Pairs}
+heap_neg = {pair: [] for pair in Pairs}
+for i0, i1 in nl.f_Chunks(grid.h, ChunkRows):
+    stack = nl.f_ReadStack(ds_list, grid, i0, i1, mask)
+    for pair in Pairs:
+        lPD, lNL = nl.f_StackPair(stack, pair, iNL, iPD, Off)
+        res = nl.f_Residuals(lPD, lNL, fit[pair])
+        bNL = stack[iNL.index(pair[0])]
+        bPD = stack[len(iNL) + iPD.index(pair[1])]
+        for heap, sign in ((heap_pos[pair], 1.), (heap_neg[pair], -1.)):
+            # Only the residuals of the sign of the file:
+            idx = nl.f_TopK(np.where(sign * res > 0, sign * res, np.nan), K)
+            i, j = np.unravel_index(idx, res.shape)
+            items = zip(nl.f_GridX(grid)[j], nl.f_GridY(grid, i0, i1)[i],
+                        bNL[i, j], bPD[i, j], res[i, j])
+            nl.f_HeapMerge(heap, sign * res[i, j], items, K)
+
+    # Show the progress:
+    print('Progress... {:4.1f}%'.format(i1 / grid.h * 100))
+
+# %% Write the results.
+print('Writing the results...')
+fields = ['lon', 'lat', 'NL', 'PD', 'residual']
+for pair in Pairs:
+    for heap, name in ((heap_pos[pair], 'LIT'), (heap_neg[pair], 'DARK')):
+        records = [tuple(float(v) for v in item)
+                   for key, item in sorted(heap, reverse=True)]
+        FileName = FileNameO + 'NL{:d}-PD{:d}_{:s}'.format(pair[0], pair[1], name)
+        nl.f_WriteCSV(FileName + '.csv', records, fields)
+        nl.f_WriteGeoJSON(FileName + '.geojson', records, fields)
+        print('NL{:d}-PD{:d} {:4s}: {:d} hot spots.'.format(
+            pair[0], pair[1], name, len(records)))
+
+# %% Script done.
+print('\nScript completed. Thanks!')
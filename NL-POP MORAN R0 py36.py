@@ -0,0 +1,163 @@
+'''
+Created on: see version log.
+@author: rigonz
+coding: utf-8
+
+IMPORTANT: requires py3.6 (rasterio)
+
+Script that:
+1) reads the NL and PD raster files aligned to a common grid, chunk by chunk,
+2) fits log10(NL) against log10(PD) for some pairs of datasets,
+3) computes the spatial autocorrelation of the residuals of the fit:
+   global Moran's I and local Moran's I (LISA) clusters,
+4) writes the LISA results as raster files.
+
+The input data is the same as in NL-POP CROSS.
+
+The Pearson coefficients of NL-POP CROSS treat the pixels as independent,
+which they are not: neighbouring pixels are strongly dependent, and the
+significance of the coefficients is inflated. Moran's I of the residuals
+measures this dependence: I ~ 0 for independent residuals, I > 0 when
+neighbouring residuals are similar (clusters of over- or under-lit areas).
+
+The neighbours are the 8 surrounding pixels (queen contiguity), added with
+array shifts (a 3x3 stencil) rather than lists of neighbours. The grid is
+read chunk by chunk, each chunk with one extra row above and below (halo),
+so the memory used does not depend on the size of the region:
+- global I uses binary weights, z-score under normality,
+- local I uses row-standardised weights, z-score under randomisation.
+
+Three passes are made over the data: fit, moments of the residuals, stencil.
+
+Version log.
+R0 (20261018):
+First trials, seems to work well.
+
+'''
+
+# %% Imports.
+import rasterio  # IMPORTANT: requires py3.6
+import numpy as np
+
+import nlpd_lib as nl
+
+# %% Directories.
+# Filenames for NL:
+RootDirIn = 'D:/0 DOWN/zz EXTSave/GIS/NIGHTLIGHT/SHP/'
+FileNameINL1 = RootDirIn + 'VNL_v2_npp_2019_global_vcmslcfg_c202102150000.median_masked_ESP_clip.tif'
+FileNameINL2 = RootDirIn + 'F16_20100111-20110731_rad_v4.avg_vis_ESP_clip.tif'
+FileNameINL3 = RootDirIn + 'F182013.v4c_web.avg_vis_ESP_clip.tif'
+
+# Filenames for POP:
+RootDirIn = 'D:/0 DOWN/zz EXTSave/GIS/POP/EUR/SHP/'
+FileNameIPD1 = RootDirIn + 'WP/ESP_clip_pd_2020_1km_UNadj.tif'
+FileNameIPD2 = RootDirIn + 'WP/ESP_clip_ppp_2020_1km_Aggregated_UNadj_d.tif'
+FileNameIPD3 = RootDirIn + 'GPW/ESP_clip gpw_v4_population_density_rev11_2020_30_sec.tif'
+FileNameIPD4 = RootDirIn + 'GPW/ESP_clip gpw_v4_population_density_adjusted_to_2015_unwpp_country_totals_rev11_2020_30_sec.tif'
+
+# Output (completed with the pair and the extension):
+RootDirOut = 'D:/0 DOWN/zz EXTSave/GIS/NIGHTLIGHT/OUT/'
+FileNameO = RootDirOut + 'LISA_ESP_'
+
+# Region (GeoJSON polygon in EPSG:4326; None to use the whole files):
+FileNameRegion = None
+RootDirCache = RootDirOut + 'CACHE/'
+
+# %% Parameters.
+Pairs = [(1, 1), (1, 3)]  # (NL, PD): best and worst log-log in NL-POP CROSS
+Off = 0.         # offset of the log; 0 removes the 0s, as f_PearsonLT0
+ZCrit = 1.96     # z-score of the significant LISA clusters (5%)
+ChunkRows = 256  # rows of the common grid read at once
+
+# %% Open data.
+print('Opening the NL and PD files...')
+dsNL = [rasterio.open(FileName) for FileName in
+        (FileNameINL1, FileNameINL2, FileNameINL3)]
+dsPD = [rasterio.open(FileName) for FileName in
+        (FileNameIPD1, FileNameIPD2, FileNameIPD3, FileNameIPD4)]
+
+# Common grid, restricted to the region:
+grid = nl.f_CommonGrid(dsNL + dsPD)
+grid, mask = nl.f_Region(FileNameRegion, grid, RootDirCache)
+print('Shape: w= {:4d} h= {:4d}'.format(grid.w, grid.h))
+
+# Only the datasets of the pairs are read:
+iNL = sorted(set(p[0] for p in Pairs))
+iPD = sorted(set(p[1] for p in Pairs))
+ds_list = [dsNL[n - 1] for n in iNL] + [dsPD[n - 1] for n in iPD]
+
+# %% Fit log10(NL) against log10(PD), first pass.
+print('Fitting the pairs...')
+mom = {pair: np.zeros(6) for pair in Pairs}
+for i0, i1 in nl.f_Chunks(grid.h, ChunkRows):
+    stack = nl.f_ReadStack(ds_list, grid, i0, i1, mask)
+    for pair in Pairs:
+        mom[pair] += nl.f_Moments(*nl.f_StackPair(stack, pair, iNL, iPD, Off))
+
+fit = {pair: nl.f_LinFit(mom[pair]) for pair in Pairs}
+
+# %% Moments of the residuals, second pass.
+print('Computing the moments of the residuals...')
+pw = {pair: np.zeros(5) for pair in Pairs}  # sums of res^0 to res^4
+for i0, i1 in nl.f_Chunks(grid.h, ChunkRows):
+    stack = nl.f_ReadStack(ds_list, grid, i0, i1, mask)
+    for pair in Pairs:
+        lPD, lNL = nl.f_StackPair(stack, pair, iNL, iPD, Off)
+        res = nl.f_Residuals(lPD, lNL, fit[pair])
+        res = res[np.isfinite(res)]
+        pw[pair] += [(res ** p).sum() for p in range(5)]
+
+# Central moments:
+mu = {}
+m2 = {}
+m4 = {}
+for pair in Pairs:
+    N, s1, s2, s3, s4 = pw[pair]
+    mu[pair] = s1 / N
+    m2[pair] = s2 / N - mu[pair] ** 2
+    m4[pair] = (s4 / N - 4 * mu[pair] * s3 / N + 6 * mu[pair] ** 2 * s2 / N
+                - 3 * mu[pair] ** 4)
+
+# %% Moran's I and LISA, third pass.
+print('Computing the spatial autocorrelation...')
+acc = {pair: np.zeros(4) for pair in Pairs}  # sums z * lag, z2, k, k2
+dst = {pair: nl.f_CreateRaster(
+    FileNameO + 'NL{:d}-PD{:d}.tif'.format(*pair), grid, 3, 'float32', np.nan,
+    ['local I', 'z-score', 'cluster: 1 HH, 2 LL, 3 HL, 4 LH'])
+    for pair in Pairs}
+for i0, i1 in nl.f_Chunks(grid.h, ChunkRows):
+    stack = nl.f_ReadHalo(ds_list, grid, i0, i1, mask)
+    for pair in Pairs:
+        lPD, lNL = nl.f_StackPair(stack, pair, iNL, iPD, Off)
+        z = nl.f_Residuals(lPD, lNL, fit[pair]) - mu[pair]
+        s, k = nl.f_QueenSums(z)
+        z = z[1:-1]
+        ok = np.isfinite(z)
+        acc[pair] += [(z[ok] * s[ok]).sum(), (z[ok] ** 2).sum(),
+                      k[ok].sum(), (k[ok] ** 2).sum()]
+
+        # LISA:
+        Ii, zI, clus = nl.f_Lisa(z, s, k, pw[pair][0], m2[pair], m4[pair],
+                                 ZCrit)
+        window = nl.f_RowWindow(grid, i0, i1)
+        dst[pair].write(Ii.astype('float32'), 1, window=window)
+        dst[pair].write(zI.astype('float32'), 2, window=window)
+        dst[pair].write(clus.astype('float32'), 3, window=window)
+
+    # Show the progress:
+    print('Progress... {:4.1f}%'.format(i1 / grid.h * 100))
+
+for pair in Pairs:
+    dst[pair].close()
+
+# %% Results.
+print('Global Moran\'s I of the log-log residuals (queen contiguity):')
+for pair in Pairs:
+    N = pw[pair][0]
+    I, E, zG = nl.f_MoranGlobal(N, acc[pair][0], acc[pair][1], acc[pair][2],
+                                acc[pair][3])
+    print('NL{:d}-PD{:d}: r= {:4.3f} N= {:d} I= {:5.3f} E[I]= {:7.5f} z= {:6.1f}'.format(
+        pair[0], pair[1], fit[pair][2], int(N), I, E, zG))
+
+# %% Script done.
+print('\nScript completed. Thanks!')
@@ -0,0 +1,134 @@
+'''
+Created on: see version log.
+@author: rigonz
+coding: utf-8
+
+IMPORTANT: requires py3.6 (rasterio)
+
+Script that:
+1) finds which pairs of NL and PD datasets have no statistics in the
+   results store, or have statistics computed with other files or parameters,
+2) reads, chunk by chunk, only the datasets of those pairs and computes their
+   moments and heatmaps (see NL-POP CROSS),
+3) keeps them in the results store,
+4) prints the Pearson coefficients of all the pairs.
+
+The input data is the same as in NL-POP CROSS; new datasets (a new release of
+WorldPop, a new year of VIIRS...) are added to the lists FileNamesNL and
+FileNamesPD.
+
+The statistics of a pair are kept in the results store (SQLite) with a key
+made of the hashes of the content of both files and of the parameters (grid,
+region, ranges and bins of the heatmaps). The grid of a pair is the common
+grid of its own two files (not of all the files, which changes when a file
+with other bounds is added), so its statistics may differ slightly from those
+of NL-POP CROSS when the files have different bounds. When a dataset is added
+or changed, only its pairs are computed again, reading only their files, in
+one pass per grid of the pairs; the hashes of the files are only computed
+again when their size or modification time change.
+
+Version log.
+R0 (20261018):
+First trials, seems to work well.
+
+'''
+
+# %% Imports.
+import rasterio  # IMPORTANT: requires py3.6
+
+import nlpd_lib as nl
+
+# %% Directories.
+# Filenames for NL:
+RootDirIn = 'D:/0 DOWN/zz EXTSave/GIS/NIGHTLIGHT/SHP/'
+FileNamesNL = [RootDirIn + 'VNL_v2_npp_2019_global_vcmslcfg_c202102150000.median_masked_ESP_clip.tif',
+               RootDirIn + 'F16_20100111-20110731_rad_v4.avg_vis_ESP_clip.tif',
+               RootDirIn + 'F182013.v4c_web.avg_vis_ESP_clip.tif']
+
+# Filenames for POP:
+RootDirIn = 'D:/0 DOWN/zz EXTSave/GIS/POP/EUR/SHP/'
+FileNamesPD = [RootDirIn + 'WP/ESP_clip_pd_2020_1km_UNadj.tif',
+               RootDirIn + 'WP/ESP_clip_ppp_2020_1km_Aggregated_UNadj_d.tif',
+               RootDirIn + 'GPW/ESP_clip gpw_v4_population_density_rev11_2020_30_sec.tif',
+               RootDirIn + 'GPW/ESP_clip gpw_v4_population_density_adjusted_to_2015_unwpp_country_totals_rev11_2020_30_sec.tif']
+
+# Results store:
+RootDirOut = 'D:/0 DOWN/zz EXTSave/GIS/NIGHTLIGHT/OUT/'
+FileNameStore = RootDirOut + 'NL-PD_STATS_ESP.sqlite'
+
+# Region (GeoJSON polygon in EPSG:4326; None to use the whole files):
+FileNameRegion = None
+RootDirCache = RootDirOut + 'CACHE/'
+
+# %% Parameters.
+RangeNL = (-2., 4.)  # log10 ranges and bins of the heatmaps, as NL-POP CROSS
+RangePD = (-3., 5.)
+Bins = 100
+ChunkRows = 256      # rows of the grid read at once
+
+# %% Open data.
+print('Opening the NL and PD files...')
+dsNL = [rasterio.open(FileName) for FileName in FileNamesNL]
+dsPD = [rasterio.open(FileName) for FileName in FileNamesPD]
+
+# Grid of each pair (common grid of its two files):
+grids = nl.f_PairGrids(dsNL, dsPD)
+print('Grids of the pairs: {:d}'.format(len(grids)))
+
+# %% Find the missing pairs.
+print('Checking the results store...')
+con = nl.f_OpenStore(FileNameStore)
+hNL = [nl.f_FileHash(con, FileName) for FileName in FileNamesNL]
+hPD = [nl.f_FileHash(con, FileName) for FileName in FileNamesPD]
+params = {}
+jobs = []
+for grid, pairs in grids.items():
+    sub, mask = nl.f_Region(FileNameRegion, grid, RootDirCache)
+    for a, b in pairs:
+        params[a, b] = nl.f_ParamsKey(sub, mask, RangeNL, RangePD, Bins)
+    missing = [(a, b) for a, b in pairs if nl.f_StoreGet(
+        con, nl.f_PairKey(hNL[a], hPD[b], params[a, b])) is None]
+    if missing:
+        jobs.append((sub, mask, missing))
+print('Pairs: {:d}, to be computed: {:d}'.format(
+    len(dsNL) * len(dsPD), sum(len(job[2]) for job in jobs)))
+
+# %% Compute the missing pairs, one pass per grid.
+for grid, mask, missing in jobs:
+    # Only the datasets of the missing pairs are read:
+    iNL = sorted(set(p[0] for p in missing))
+    iPD = sorted(set(p[1] for p in missing))
+    ds_list = [dsNL[a] for a in iNL] + [dsPD[b] for b in iPD]
+    print('Shape: w= {:4d} h= {:4d}, reading {:d} of {:d} datasets...'.format(
+        grid.w, grid.h, len(ds_list), len(dsNL) + len(dsPD)))
+    mom = None
+    hist = None
+    for i0, i1 in nl.f_Chunks(grid.h, ChunkRows):
+        stack = nl.f_ReadStack(ds_list, grid, i0, i1, mask)
+        stack = stack.reshape(len(ds_list), -1)
+        mom, hist = nl.f_PairMoments(stack[:len(iNL)], stack[len(iNL):],
+                                     RangeNL, RangePD, Bins, mom, hist)
+
+        # Show the progress:
+        print('Progress... {:4.1f}%'.format(i1 / grid.h * 100))
+
+    # Keep the missing pairs (the others read may have another grid):
+    for k, a in enumerate(iNL):
+        for m, b in enumerate(iPD):
+            if (a, b) in missing:
+                nl.f_StorePut(con, nl.f_PairKey(hNL[a], hPD[b], params[a, b]),
+                              hNL[a], hPD[b], params[a, b], mom[k, m],
+                              hist[k, m])
+
+# %% Results.
+print('Pearson coeff. after removing no-data / after removing 0s and no-data, LOG-LOG:')
+for a in range(len(dsNL)):
+    for b in range(len(dsPD)):
+        mom, hist = nl.f_StoreGet(con, nl.f_PairKey(hNL[a], hPD[b],
+                                                    params[a, b]))
+        print('NL{:d}-PD{:d} = {:4.3f} / {:4.3f}.'.format(
+            a + 1, b + 1, nl.f_LinFit(mom[0])[2], nl.f_LinFit(mom[1])[2]))
+con.close()
+
+# %% Script done.
+print('\nScript completed. Thanks!')
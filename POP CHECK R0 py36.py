@@ -23,13 +23,17 @@ associated to the same geographical location.
 Version log.
 R0 (20210512):
 First trials, seems to work well.
+R1 (20261018):
+The new bands are read chunk by chunk and aligned with nlpd_lib; the last row
+and column were left as 0s, and are now read as the others.
 
 '''
 
 # %% Imports.
 import rasterio  # IMPORTANT: requires py3.6
 import numpy as np
-from matplotlib import pyplot as plt
+
+import nlpd_lib as nl
 
 # %% Directories.
 RootDirIn = 'D:/0 DOWN/zz EXTSave/GIS/POP/EUR/SHP/'
@@ -40,20 +44,14 @@ FileNameI2 = RootDirIn + 'WP/ESP_clip_ppp_2020_1km_Aggregated_UNadj_d.tif'
 FileNameI3 = RootDirIn + 'GPW/ESP_clip gpw_v4_population_density_rev11_2020_30_sec.tif'
 FileNameI4 = RootDirIn + 'GPW/ESP_clip gpw_v4_population_density_adjusted_to_2015_unwpp_country_totals_rev11_2020_30_sec.tif'
 
-# %% Read data.
-# Open files:
-print('Opening and reading the files...')
+# %% Open data.
+# Open files (read later, when the new bands are populated):
+print('Opening the files...')
 ds1 = rasterio.open(FileNameI1)
 ds2 = rasterio.open(FileNameI2)
 ds3 = rasterio.open(FileNameI3)
 ds4 = rasterio.open(FileNameI4)
 
-# Read data:
-band1 = ds1.read(1)
-band2 = ds2.read(1)
-band3 = ds3.read(1)
-band4 = ds4.read(1)
-
 # %% Check the datasets.
 print('Checking the data...')
 # Bounds:
@@ -125,37 +123,25 @@ width = int(np.ceil((right - left) / res + 1))
 res_x = (right - left) / (width - 1)
 res_y = (top - bottom) / (height - 1)
 
-# Check (valid for east + north hemispheres only!):
+# Check (x grows to the east and y to the north, in any hemisphere):
 if right > min(ds1.bounds.right, ds2.bounds.right, ds3.bounds.right, ds4.bounds.right):
     print('WARNING: right boundary exceeded.')
-if bottom > max(ds1.bounds.bottom, ds2.bounds.bottom, ds3.bounds.bottom, ds4.bounds.bottom):
+if bottom < max(ds1.bounds.bottom, ds2.bounds.bottom, ds3.bounds.bottom, ds4.bounds.bottom):
     print('WARNING: bottom boundary exceeded.')
 
-# Create new bands:
-print('Creating the new bands...')
-b1 = np.full((height, width), 0.)
-b2 = np.full((height, width), 0.)
-b3 = np.full((height, width), 0.)
-b4 = np.full((height, width), 0.)
-
-# Populate the new bands:
-count = 0
-for i in range(0, height-1, 1):
-    for j in range(0, width-1, 1):
-        x, y = (left + j * res_x, top - i * res_y)
-        row, col = ds1.index(x, y)
-        b1[i, j] = band1[row, col]
-        row, col = ds2.index(x, y)
-        b2[i, j] = band2[row, col]
-        row, col = ds3.index(x, y)
-        b3[i, j] = band3[row, col]
-        row, col = ds4.index(x, y)
-        b4[i, j] = band4[row, col]
+# Common grid:
+grid = nl.Grid(left, top, res_x, res_y, width, height)
+
+# Populate the new bands, reading the files chunk by chunk (the pixels out of
+# a file are no-data, not 0s, and are removed below):
+print('Reading the files...')
+b1, b2, b3, b4 = np.empty((4, height, width))
+for i0, i1 in nl.f_Chunks(height, 256):
+    b1[i0:i1], b2[i0:i1], b3[i0:i1], b4[i0:i1] = nl.f_ReadStack(
+        [ds1, ds2, ds3, ds4], grid, i0, i1)
 
     # Show the progress:
-    if count % height % 50 == 0:
-        print('Progress... {:4.1f}%'.format(count/height*100))
-    count += 1
+    print('Progress... {:4.1f}%'.format(i1 / height * 100))
 
 # %% Flatten and clear nodata.
 print('Preparing the new bands...')
@@ -181,6 +167,8 @@ print('DS2-4 = {:4.3f}.'.format(np.corrcoef(b2fm, b4fm)[0, 1]))
 print('DS3-4 = {:4.3f}.'.format(np.corrcoef(b3fm, b4fm)[0, 1]))
 
 # %% Draw histograms.
+from matplotlib import pyplot as plt  # imported only to draw the charts
+
 # Auxiliaries:
 color = ['k', 'r', 'b', 'g']
 label = ['DS1', 'DS2', 'DS3', 'DS4']
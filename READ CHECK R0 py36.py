@@ -0,0 +1,146 @@
+'''
+Created on: see version log.
+@author: rigonz
+coding: utf-8
+
+IMPORTANT: requires py3.6 (rasterio)
+
+Script that:
+1) creates synthetic raster files aligned to the edges of the pixels of the
+   common grid, which is the normal case of files clipped to the same
+   rectangle (the bounds of ESP in the README): at 30 and 15 arc-sec, and
+   shifted by whole pixels,
+2) reads them chunk by chunk with f_ReadStack,
+3) checks them against a per-pixel reference: the value of each pixel of the
+   files is its own index, so the source pixel of each location of the grid
+   is known by construction (ds.index() is not a reference: it does not snap
+   the locations on the edges either, and reads some columns twice),
+4) reads a region (part of the grid and mask) and checks that each location
+   is read from the same source pixel as in the whole grid, with f_ReadStack
+   (NL-POP CROSS, STATS...) and tile by tile with f_ReadStackTiled (NL-POP
+   BATCH).
+
+A location on the edge of two pixels must go to the same pixel whatever the
+rounding: otherwise some rows and columns are read twice and others skipped,
+and e.g. NL-POP MORAN finds artificial neighbours.
+
+It needs no input files; it should be run after any change to the reading
+functions of nlpd_lib (f_Index, f_ReadRows, f_ReadStack...).
+
+Version log.
+R0 (20261019):
+First trials, seems to work well.
+
+'''
+
+# %% Imports.
+import os
+import shutil
+import tempfile
+
+import rasterio  # IMPORTANT: requires py3.6
+import numpy as np
+
+import nlpd_lib as nl
+
+# %% Parameters.
+L0 = -9.65   # bounds of the files, as ESP in the README
+T0 = 43.9
+R0 = 4.5
+B0 = 36.0
+Res = 1 / 120.
+ChunkRows = 256
+
+Region = {'type': 'Polygon',  # irregular, so that the offsets are not round
+          'coordinates': [[[-7.31, 42.77], [1.93, 43.52], [3.07, 37.13],
+                           [-5.52, 36.61], [-7.31, 42.77]]]}
+
+# Synthetic files: name, pixels per pixel of 30 arc-sec, shift of the top left
+# corner to the west and to the north (own pixels):
+Specs = [('A', 1, 0, 0),
+         ('B', 2, 0, 0),
+         ('C', 1, 3, 2)]
+
+# %% Synthetic data.
+print('Creating the synthetic data...')
+RootDirTmp = tempfile.mkdtemp()
+ds_list = []
+FileNames = []
+shape = []
+for name, k, sx, sy in Specs:
+    r = Res / k
+    w = int(round((R0 - L0) / r)) + sx + 1
+    h = int(round((T0 - B0) / r)) + sy + 1
+    if sx == 0:
+        w -= 1  # exactly on the bounds
+    if sy == 0:
+        h -= 1
+    FileName = os.path.join(RootDirTmp, 'READ_{:s}.tif'.format(name))
+    band = np.arange(h * w, dtype=np.float64).reshape(h, w)  # < 2^24
+    nl.f_WriteRaster(FileName, [band], nl.Grid(L0 - sx * r, T0 + sy * r, r, r,
+                                               w, h))
+    ds_list.append(rasterio.open(FileName))
+    FileNames.append(FileName)
+    shape.append((h, w))
+
+grid = nl.f_CommonGrid(ds_list)
+print('Shape: w= {:4d} h= {:4d}'.format(grid.w, grid.h))
+
+# %% Read.
+print('Reading the files...')
+stack = np.empty((len(ds_list), grid.h, grid.w))
+for i0, i1 in nl.f_Chunks(grid.h, ChunkRows):
+    stack[:, i0:i1] = nl.f_ReadStack(ds_list, grid, i0, i1)
+
+# %% Check.
+print('Checking the results...')
+ok = True
+ii, jj = np.mgrid[0:grid.h, 0:grid.w]
+for n, (name, k, sx, sy) in enumerate(Specs):
+    # Reference, by construction:
+    h, w = shape[n]
+    row = ii * k + sy
+    col = jj * k + sx
+    ref = np.where((row < h) & (col < w), row * w + col, nl.NODATA)
+    bad = int((stack[n] != ref).sum())
+    if bad:
+        print('WARNING: {:s}, {:d} pixels are not the reference.'.format(name, bad))
+        ok = False
+
+    # Rows and columns read twice or skipped (first column and first row):
+    for label, v, src in (('rows', stack[n, :, 0], stack[n, :, 0] // w),
+                          ('columns', stack[n, 0], stack[n, 0] % w)):
+        d = np.diff(src[v >= 0])
+        if (d != k).any():
+            print('WARNING: {:s}, {:d} {:s} read twice, {:d} skipped.'.format(
+                name, int((d < k).sum()), label, int((d > k).sum())))
+            ok = False
+
+# Region:
+sub = nl.f_RegionGrid(grid, [Region])
+mask = nl.f_RegionMask([Region], sub)
+oi, oj = nl.f_GridOffset(grid, sub)
+for i0, i1 in nl.f_Chunks(sub.h, ChunkRows):
+    part = nl.f_ReadStack(ds_list, sub, i0, i1, mask)
+    whole = stack[:, oi + i0:oi + i1, oj:oj + sub.w]
+    tiled = nl.f_ReadStackTiled(FileNames, grid, sub, i0, i1, mask)
+    m = mask[i0:i1]
+    bad = int((part[:, m] != whole[:, m]).sum())
+    if bad:
+        print('WARNING: region, rows {:d}-{:d}, {:d} pixels are not as in the '
+              'whole grid.'.format(i0, i1, bad))
+        ok = False
+    if not np.array_equal(tiled, part):
+        print('WARNING: region, rows {:d}-{:d}, {:d} pixels are not the same '
+              'tile by tile.'.format(i0, i1, int((tiled != part).sum())))
+        ok = False
+
+for ds in ds_list:
+    ds.close()
+nl.f_CloseCached()
+shutil.rmtree(RootDirTmp)
+
+print('Results: {:s}'.format('OK' if ok else 'ERRORS'))
+
+# %% Script done.
+print('\nScript completed. Thanks!')
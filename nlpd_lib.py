@@ -0,0 +1,1562 @@
+'''
+Created on: see version log.
+@author: rigonz
+coding: utf-8
+
+IMPORTANT: requires py3.6 (rasterio)
+
+Module with the functions shared by the scripts that:
+1) define a common grid for a series of raster files,
+2) read the raster files aligned to that grid, chunk by chunk,
+3) compute statistics that can be accumulated chunk by chunk,
+4) reproject the aligned bands to an equal-area grid,
+5) write the results as new raster, CSV, GeoJSON or Parquet files,
+6) keep the statistics of each pair of datasets in a results store,
+7) run batches of regions in a pool of processes,
+8) profile the stages of the scripts (see f_ProfileStart),
+9) count the no-data, 0s and positive values of all the sources at once.
+
+The scripts NL CHECK, POP CHECK and NL-POP CROSS populate the new bands pixel
+by pixel with ds.index(); here the same sampling is done with whole rows of
+pixels at once, reading only the window of each file that is required.
+
+No-data (the no-data value of the file, or a location outside of the file)
+is returned as NODATA, which is negative: the masks used in the scripts
+(< 0 for no-data, <= 0 for no-data and 0s) remain valid.
+
+On the EPSG:4326 grid the pixels shrink with the latitude; the statistics can
+be weighted by the area of the pixels, given per row (see f_RowWeights) and
+broadcast along the rows, without an array of weights per pixel.
+
+Version log.
+R0 (20261018):
+First trials, seems to work well.
+
+'''
+
+# %% Imports.
+from collections import namedtuple, OrderedDict
+import csv
+import hashlib
+import heapq
+import importlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import rasterio  # IMPORTANT: requires py3.6
+from rasterio.windows import Window
+from rasterio.transform import Affine
+import numpy as np
+
+# The optional libraries (numba, pyarrow) and the parts of rasterio used by
+# few functions are imported when they are first needed (see f_Lazy), so
+# that the scripts that only compute statistics start quickly.
+
+try:
+    import resource  # not available on Windows, for f_PeakRSS
+except ImportError:
+    resource = None
+
+# %% Constants.
+NODATA = -1.
+EDGE_TOL = 1e-6  # pixels; a location on the edge of two pixels (up to the
+                 # rounding) is in the next one, as with exact arithmetic
+_modules = {}  # modules imported by f_Lazy
+
+# WGS84 ellipsoid (m) and radius of the sphere of the same area (m):
+WGS84_A = 6378137.
+WGS84_F = 1 / 298.257223563
+R_AUTHALIC = 6371007.181
+
+# Common grid: pixel (i, j) is sampled at (l + (oj + j) * r_x,
+# t - (oi + i) * r_y), which is the top left corner of its footprint in the
+# rasters written (see f_GridTransform); the region mask tests the centre of
+# that footprint. A part of a grid (region, columns of a chunk, tile) keeps
+# the origin (l, t) of the whole grid and its offset (oi, oj) in rows and
+# columns, so that a location is always computed in the same way, and read
+# from the same source pixel (see f_GridX, f_GridY).
+Grid = namedtuple('Grid', ['l', 't', 'r_x', 'r_y', 'w', 'h', 'oi', 'oj'])
+Grid.__new__.__defaults__ = (0, 0)  # no offset
+
+
+# %% Functions: lazy imports.
+def f_Lazy(name):
+    '''
+    Function that:
+    - receives the name of a module (e.g. 'numba', 'pyarrow.parquet'),
+    - imports it the first time it is required,
+    - returns the module, or None if it is not available.
+    '''
+    if name not in _modules:
+        try:
+            _modules[name] = importlib.import_module(name)
+        except ImportError:
+            _modules[name] = None
+    return(_modules[name])
+
+
+# %% Functions: grid.
+def f_CommonGrid(ds_list, res=1 / 120.):
+    '''
+    Function that:
+    - receives a list of open datasets and the target resolution (deg),
+    - finds the boundaries common to all the datasets,
+    - returns the common Grid, as in NL-POP CROSS.
+    '''
+    l = max(ds.bounds.left for ds in ds_list)
+    t = min(ds.bounds.top for ds in ds_list)
+    r = min(ds.bounds.right for ds in ds_list)
+    b = max(ds.bounds.bottom for ds in ds_list)
+
+    h = int(np.ceil((t - b) / res + 1))
+    w = int(np.ceil((r - l) / res + 1))
+
+    r_x = (r - l) / (w - 1)
+    r_y = (t - b) / (h - 1)
+    return(Grid(l, t, r_x, r_y, w, h))
+
+
+def f_GridOrigin(grid):
+    '''
+    Function that:
+    - receives a Grid,
+    - returns the location (x, y) of its pixel (0, 0).
+    '''
+    return(grid.l + grid.oj * grid.r_x, grid.t - grid.oi * grid.r_y)
+
+
+def f_GridX(grid):
+    '''
+    Function that:
+    - receives a Grid,
+    - returns the x of the locations of its columns, from the integer offset
+      of each column in the whole grid.
+    '''
+    return(grid.l + (grid.oj + np.arange(grid.w)) * grid.r_x)
+
+
+def f_GridY(grid, i0, i1):
+    '''
+    Function that:
+    - receives a Grid and a range of rows,
+    - returns the y of the locations of the rows, from the integer offset of
+      each row in the whole grid.
+    '''
+    return(grid.t - (grid.oi + np.arange(i0, i1)) * grid.r_y)
+
+
+def f_GridTransform(grid):
+    '''
+    Function that:
+    - receives a Grid,
+    - returns the affine transform of a raster holding that grid.
+    '''
+    l, t = f_GridOrigin(grid)
+    return(Affine(grid.r_x, 0., l, 0., -grid.r_y, t))
+
+
+def f_Chunks(h, rows=256):
+    '''
+    Function that:
+    - receives the height of the grid and the number of rows per chunk,
+    - yields the (first, last + 1) rows of each chunk.
+    '''
+    for i0 in range(0, h, rows):
+        yield(i0, min(i0 + rows, h))
+
+
+def f_RowWeights(grid, i0, i1, method='ellipsoid'):
+    '''
+    Function that:
+    - receives a Grid (EPSG:4326), a range of rows and the method:
+      'ellipsoid' for the exact area on WGS84, 'cos' for the usual
+      approximation R^2 * cos(lat) * dlon * dlat on the sphere,
+    - computes the area of a pixel of each row (its footprint, see Grid),
+      which is the same for all the pixels of a row,
+    - returns an array (i1 - i0) with the areas (km2), to be broadcast along
+      the rows.
+    '''
+    lat = np.radians(f_GridY(grid, i0, i1) - grid.r_y / 2)  # centres
+    dlon = np.radians(grid.r_x)
+    dlat = np.radians(grid.r_y)
+    if method == 'cos':
+        return(R_AUTHALIC ** 2 * np.cos(lat) * dlon * dlat / 1e6)
+    if method != 'ellipsoid':
+        raise ValueError('Unknown method of the weights: {}'.format(method))
+
+    # Area between the parallels of the edges of the pixels:
+    e2 = WGS84_F * (2 - WGS84_F)
+    e = np.sqrt(e2)
+
+    def q(phi):
+        s = np.sin(phi)
+        return((1 - e2) * (s / (1 - e2 * s * s) -
+                           np.log((1 - e * s) / (1 + e * s)) / (2 * e)))
+    return(WGS84_A ** 2 * dlon * (q(lat + dlat / 2) - q(lat - dlat / 2)) / 2 / 1e6)
+
+
+# %% Functions: reading.
+def f_Index(ds, grid, i0, i1):
+    '''
+    Function that:
+    - receives an open dataset, a Grid and a range of rows of the grid,
+    - computes the (row, col) of the dataset for each row and column of the
+      grid, as ds.index() does for a single location, but snapping the
+      locations on the edges of the pixels (see EDGE_TOL),
+    - returns the rows and the cols (-1 if outside of the dataset).
+    '''
+    tr = ds.transform
+    x = f_GridX(grid)
+    y = f_GridY(grid, i0, i1)
+    rows = np.floor((y - tr.f) / tr.e + EDGE_TOL).astype(np.int64)
+    cols = np.floor((x - tr.c) / tr.a + EDGE_TOL).astype(np.int64)
+    rows[(rows < 0) | (rows >= ds.height)] = -1
+    cols[(cols < 0) | (cols >= ds.width)] = -1
+    return(rows, cols)
+
+
+def f_ReadRows(ds, grid, i0, i1, band=1):
+    '''
+    Function that:
+    - receives an open dataset, a Grid and a range of rows of the grid,
+    - reads only the window of the dataset covering those rows,
+    - samples it at the grid locations,
+    - returns an array (i1 - i0, w) with NODATA outside of the dataset.
+    '''
+    rows, cols = f_Index(ds, grid, i0, i1)
+    out = np.full((i1 - i0, grid.w), NODATA)
+    r_ok = rows >= 0
+    c_ok = cols >= 0
+    if not r_ok.any() or not c_ok.any():
+        return(out)
+
+    # Window of the dataset:
+    r0, r1 = rows[r_ok].min(), rows[r_ok].max() + 1
+    c0, c1 = cols[c_ok].min(), cols[c_ok].max() + 1
+    st = f_StageStart('read')
+    data = ds.read(band, window=Window(c0, r0, c1 - c0, r1 - r0))
+    f_StageEnd(st, data.size, data.nbytes)
+
+    # Sample and clear nodata:
+    st = f_StageStart('align')
+    sub = data[np.ix_(rows[r_ok] - r0, cols[c_ok] - c0)].astype(np.float64)
+    if ds.nodata is not None:
+        sub[sub == ds.nodata] = NODATA
+    sub[np.isnan(sub)] = NODATA
+    out[np.ix_(r_ok, c_ok)] = sub
+    f_StageEnd(st, out.size)
+    return(out)
+
+
+def f_ReadStack(ds_list, grid, i0, i1, mask=None):
+    '''
+    Function that:
+    - receives a list of open datasets, a Grid, a range of rows and optionally
+      the mask (h, w) of a region (see f_RegionMask),
+    - reads only the columns of the rows where the mask is set, and nothing
+      if it is not set in any of them,
+    - returns an array (n, i1 - i0, w) with the aligned rows of each dataset,
+      NODATA outside of the mask.
+    '''
+    if mask is None:
+        return(np.stack([f_ReadRows(ds, grid, i0, i1) for ds in ds_list]))
+
+    stack = np.full((len(ds_list), i1 - i0, grid.w), NODATA)
+    m = mask[i0:i1]
+    rows = np.flatnonzero(m.any(axis=1))
+    cols = np.flatnonzero(m.any(axis=0))
+    if rows.size == 0:
+        return(stack)
+
+    # Sub-grid with the columns of the mask:
+    a, b = rows[0], rows[-1] + 1
+    j0, j1 = cols[0], cols[-1] + 1
+    sub = grid._replace(oj=grid.oj + j0, w=j1 - j0)
+    for k, ds in enumerate(ds_list):
+        stack[k, a:b, j0:j1] = f_ReadRows(ds, sub, i0 + a, i0 + b)
+    st = f_StageStart('mask')
+    stack[:, ~m] = NODATA
+    f_StageEnd(st, stack.size)
+    return(stack)
+
+
+# %% Functions: regions.
+def f_ReadRegion(FileName):
+    '''
+    Function that:
+    - receives the name of a GeoJSON file (a geometry, a feature or a
+      collection of features) in EPSG:4326,
+    - returns the list of its geometries.
+    '''
+    with open(FileName) as f:
+        gj = json.load(f)
+    if gj['type'] == 'FeatureCollection':
+        return([feat['geometry'] for feat in gj['features']])
+    if gj['type'] == 'Feature':
+        return([gj['geometry']])
+    return([gj])
+
+
+def f_RegionBounds(geoms):
+    '''
+    Function that:
+    - receives a list of GeoJSON geometries,
+    - returns their bounds (left, bottom, right, top).
+    '''
+    xy = np.concatenate([np.array(ring, dtype=np.float64).reshape(-1, 2)
+                         for g in geoms for ring in f_Rings(g)])
+    return(xy[:, 0].min(), xy[:, 1].min(), xy[:, 0].max(), xy[:, 1].max())
+
+
+def f_Rings(geom):
+    '''
+    Function that:
+    - receives a GeoJSON (Multi)Polygon,
+    - returns the list of its rings.
+    '''
+    if geom['type'] == 'Polygon':
+        return(geom['coordinates'])
+    return([ring for poly in geom['coordinates'] for ring in poly])
+
+
+def f_RegionGrid(grid, geoms):
+    '''
+    Function that:
+    - receives a Grid and a list of GeoJSON geometries,
+    - returns the part of the Grid covering the bounds of the geometries
+      (the same locations, fewer rows and columns: the offset of the part
+      changes, not the origin).
+    '''
+    left, bottom, right, top = f_RegionBounds(geoms)
+    l, t = f_GridOrigin(grid)
+    j0 = max(int(np.floor((left - l) / grid.r_x)), 0)
+    j1 = min(int(np.ceil((right - l) / grid.r_x)) + 1, grid.w)
+    i0 = max(int(np.floor((t - top) / grid.r_y)), 0)
+    i1 = min(int(np.ceil((t - bottom) / grid.r_y)) + 1, grid.h)
+    if j0 >= j1 or i0 >= i1:
+        raise ValueError('The region does not intersect the common grid.')
+    return(grid._replace(oi=grid.oi + i0, oj=grid.oj + j0, w=j1 - j0,
+                         h=i1 - i0))
+
+
+def f_RegionMask(geoms, grid, CacheDir=None):
+    '''
+    Function that:
+    - receives a list of GeoJSON geometries, a Grid and a cache folder,
+    - rasterizes the geometries on the grid (set if the centre of the
+      footprint of the pixel is inside, see Grid), only once: the mask is
+      kept in the cache folder, packed to 1 bit per pixel, with a name given
+      by the hash of the geometries and the grid,
+    - returns the mask (h, w), boolean.
+    '''
+    key = hashlib.sha1((json.dumps(geoms, sort_keys=True) +
+                        repr(tuple(grid)) + 'footprint').encode()).hexdigest()
+    FileName = None
+    if CacheDir is not None:
+        FileName = os.path.join(CacheDir, 'MASK_' + key + '.npz')
+        if os.path.exists(FileName):
+            with np.load(FileName) as f:
+                return(np.unpackbits(f['bits'])[:grid.h * grid.w]
+                       .reshape(grid.h, grid.w).astype(bool))
+
+    # The same pixels as the rasters written:
+    tr = f_GridTransform(grid)
+    features = f_Lazy('rasterio.features')
+    mask = features.rasterize([(g, 1) for g in geoms],
+                              out_shape=(grid.h, grid.w), transform=tr,
+                              fill=0, dtype='uint8').astype(bool)
+    if FileName is not None:
+        os.makedirs(CacheDir, exist_ok=True)
+        np.savez(FileName, bits=np.packbits(mask))
+    return(mask)
+
+
+def f_Region(FileNameRegion, grid, CacheDir=None):
+    '''
+    Function that:
+    - receives the GeoJSON file of a region (or None), a Grid and a cache
+      folder,
+    - returns the Grid restricted to the region and its mask (the same Grid
+      and None if there is no region).
+    '''
+    if FileNameRegion is None:
+        return(grid, None)
+    geoms = f_ReadRegion(FileNameRegion)
+    grid = f_RegionGrid(grid, geoms)
+    return(grid, f_RegionMask(geoms, grid, CacheDir))
+
+
+# %% Functions: results store.
+def f_OpenStore(FileName):
+    '''
+    Function that:
+    - receives the file name of the results store (SQLite),
+    - creates the tables if needed: the hashes of the input files and the
+      statistics of each pair of datasets,
+    - returns the connection (to be closed by the caller).
+    '''
+    con = sqlite3.connect(FileName)
+    con.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, '
+                'size INTEGER, mtime INTEGER, hash TEXT)')
+    con.execute('CREATE TABLE IF NOT EXISTS pairs (key TEXT PRIMARY KEY, '
+                'hash_nl TEXT, hash_pd TEXT, params TEXT, bins INTEGER, '
+                'mom BLOB, hist BLOB, created TEXT)')
+    con.commit()
+    return(con)
+
+
+def f_FileHash(con, FileName, block=1 << 20):
+    '''
+    Function that:
+    - receives the connection to the results store and a file name,
+    - computes the hash (sha1) of the content of the file, only if its size
+      or modification time have changed since the last time,
+    - returns the hash.
+    '''
+    st = os.stat(FileName)
+    path = os.path.abspath(FileName)
+    row = con.execute('SELECT size, mtime, hash FROM files WHERE path = ?',
+                      (path,)).fetchone()
+    if row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+        return(row[2])
+
+    sha = hashlib.sha1()
+    with open(FileName, 'rb') as f:
+        for data in iter(lambda: f.read(block), b''):
+            sha.update(data)
+    con.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                (path, st.st_size, st.st_mtime_ns, sha.hexdigest()))
+    con.commit()
+    return(sha.hexdigest())
+
+
+def f_PairGrids(dsNL, dsPD):
+    '''
+    Function that:
+    - receives the lists of open NL and PD datasets,
+    - finds the common Grid of each pair (NL, PD), from its two files only:
+      adding a dataset, even with other bounds, does not change the grid (nor
+      the key in the results store, see f_ParamsKey) of the other pairs,
+    - returns a dict {Grid: [(NL, PD), ...]} with the pairs of each grid
+      (indices from 0), so that the pairs of the same grid are read together.
+    '''
+    grids = OrderedDict()
+    for a, dsa in enumerate(dsNL):
+        for b, dsb in enumerate(dsPD):
+            grids.setdefault(f_CommonGrid([dsa, dsb]), []).append((a, b))
+    return(grids)
+
+
+def f_ParamsKey(grid, mask, rNL, rPD, bins):
+    '''
+    Function that:
+    - receives the Grid of the pair (see f_PairGrids, restricted to the
+      region), the mask of the region (or None) and the ranges and bins of
+      the histograms,
+    - returns a hash of all of them: the statistics of a pair computed with
+      other parameters are not valid.
+    '''
+    rNL = tuple(float(v) for v in rNL)  # (-2, 4) from a config = (-2., 4.)
+    rPD = tuple(float(v) for v in rPD)
+    sha = hashlib.sha1(repr((tuple(grid), rNL, rPD, int(bins))).encode())
+    if mask is not None:
+        sha.update(np.packbits(mask).tobytes())
+    return(sha.hexdigest())
+
+
+def f_PairKey(hNL, hPD, params):
+    '''
+    Function that:
+    - receives the hashes of the NL and PD files and of the parameters,
+    - returns the key of the pair in the results store.
+    '''
+    return(hashlib.sha1((hNL + hPD + params).encode()).hexdigest())
+
+
+def f_StoreGet(con, key):
+    '''
+    Function that:
+    - receives the connection to the results store and the key of a pair,
+    - returns the moments (2, 6) and the histogram (bins, bins) of the pair
+      (see f_PairMoments), or None if they are not in the store.
+    '''
+    row = con.execute('SELECT bins, mom, hist FROM pairs WHERE key = ?',
+                      (key,)).fetchone()
+    if row is None:
+        return(None)
+    mom = np.frombuffer(row[1], dtype=np.float64).reshape(2, 6)
+    hist = np.frombuffer(row[2], dtype=np.int64).reshape(row[0], row[0])
+    return(mom, hist)
+
+
+def f_StorePut(con, key, hNL, hPD, params, mom, hist):
+    '''
+    Function that:
+    - receives the connection to the results store, the key and hashes of a
+      pair, and its moments (2, 6) and histogram (bins, bins),
+    - keeps them in the store.
+    '''
+    con.execute('INSERT OR REPLACE INTO pairs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, hNL, hPD, params, hist.shape[0],
+                 np.ascontiguousarray(mom, dtype=np.float64).tobytes(),
+                 np.ascontiguousarray(hist, dtype=np.int64).tobytes(),
+                 time.strftime('%Y%m%d %H:%M:%S')))
+    con.commit()
+
+
+# %% Functions: equal-area reprojection.
+def f_EqualAreaGrid(grid, crs='auto', res=1000.):
+    '''
+    Function that:
+    - receives a Grid in EPSG:4326, an equal-area CRS and its resolution (m);
+      crs = 'auto' is a Lambert azimuthal equal-area projection centred on
+      the grid, valid in any hemisphere ('EPSG:3035' is LAEA Europe),
+    - finds the projected bounds of the grid (densified edges),
+    - returns the CRS and the projected Grid (in m).
+    '''
+    l, t = f_GridOrigin(grid)
+    r = l + (grid.w - 1) * grid.r_x
+    b = t - (grid.h - 1) * grid.r_y
+    if crs == 'auto':
+        crs = ('+proj=laea +lat_0={:.6f} +lon_0={:.6f} +x_0=0 +y_0=0 '
+               '+datum=WGS84 +units=m +no_defs').format((t + b) / 2,
+                                                        (l + r) / 2)
+    warp = f_Lazy('rasterio.warp')
+    left, bottom, right, top = warp.transform_bounds('EPSG:4326', crs, l, b,
+                                                     r, t, densify_pts=101)
+    w = int(np.ceil((right - left) / res)) + 1
+    h = int(np.ceil((top - bottom) / res)) + 1
+    return(crs, Grid(left, top, res, res, w, h))
+
+
+def f_ReprojectIndex(grid, crs, pgrid, CacheDir=None, rows=256):
+    '''
+    Function that:
+    - receives a Grid in EPSG:4326, a CRS, a projected Grid and a cache folder,
+    - finds, for each pixel of the projected Grid, the nearest pixel of the
+      Grid (flat index, -1 if outside), only once: the table is kept in the
+      cache folder with a name given by the hash of both grids,
+    - returns the table (pgrid.h * pgrid.w), to be used with f_Reproject.
+    '''
+    key = hashlib.sha1((repr(tuple(grid)) + crs +
+                        repr(tuple(pgrid))).encode()).hexdigest()
+    FileName = None
+    if CacheDir is not None:
+        FileName = os.path.join(CacheDir, 'LUT_' + key + '.npy')
+        if os.path.exists(FileName):
+            return(np.load(FileName, mmap_mode='r'))
+
+    lut = np.full(pgrid.h * pgrid.w, -1, dtype=np.int64)
+    x = f_GridX(pgrid)
+    l, t = f_GridOrigin(grid)
+    for i0, i1 in f_Chunks(pgrid.h, rows):
+        y = f_GridY(pgrid, i0, i1)
+        xx, yy = np.meshgrid(x, y)
+        lon, lat = f_Lazy('rasterio.warp').transform(crs, 'EPSG:4326',
+                                                     xx.ravel(), yy.ravel())
+        j = np.rint((np.array(lon) - l) / grid.r_x).astype(np.int64)
+        i = np.rint((t - np.array(lat)) / grid.r_y).astype(np.int64)
+        ok = (i >= 0) & (i < grid.h) & (j >= 0) & (j < grid.w)
+        lut[i0 * pgrid.w:i1 * pgrid.w][ok] = i[ok] * grid.w + j[ok]
+    if FileName is not None:
+        os.makedirs(CacheDir, exist_ok=True)
+        np.save(FileName, lut)
+    return(lut)
+
+
+def f_Reproject(band, lut, pgrid):
+    '''
+    Function that:
+    - receives a band (h, w) of a Grid, the table from f_ReprojectIndex and
+      the projected Grid,
+    - gathers the values of the band (no interpolation),
+    - returns the projected band (pgrid.h, pgrid.w), NODATA outside.
+    '''
+    ok = lut >= 0
+    out = np.full(lut.shape, NODATA)
+    out[ok] = band.ravel()[lut[ok]]
+    return(out.reshape(pgrid.h, pgrid.w))
+
+
+# %% Functions: writing.
+def f_CreateRaster(FileName, grid, count=1, dtype='float32', nodata=None,
+                   descriptions=None, crs='EPSG:4326', **options):
+    '''
+    Function that:
+    - receives the file name, the Grid, the number of bands, the CRS and
+      other creation options of the GeoTIFF (tiled, predictor...),
+    - creates a GeoTIFF to be written chunk by chunk with
+      dst.write(array, band, window=f_RowWindow(grid, i0, i1)),
+    - returns the open dataset (to be closed by the caller).
+    '''
+    profile = {'driver': 'GTiff', 'height': grid.h, 'width': grid.w,
+               'count': count, 'dtype': dtype, 'crs': crs,
+               'transform': f_GridTransform(grid), 'nodata': nodata,
+               'compress': 'deflate'}
+    profile.update(options)
+    dst = rasterio.open(FileName, 'w', **profile)
+    if descriptions is not None:
+        for k, desc in enumerate(descriptions):
+            dst.set_band_description(k + 1, desc)
+    return(dst)
+
+
+def f_RowWindow(grid, i0, i1):
+    '''
+    Function that:
+    - receives a Grid and a range of rows,
+    - returns the window of a raster of the grid covering those rows.
+    '''
+    return(Window(0, i0, grid.w, i1 - i0))
+
+
+def f_WriteRaster(FileName, bands, grid, dtype='float32', nodata=None,
+                  descriptions=None, crs='EPSG:4326'):
+    '''
+    Function that:
+    - receives the file name, a list of 2D arrays (h, w), their Grid and CRS,
+    - writes them as the bands of a GeoTIFF.
+    '''
+    with f_CreateRaster(FileName, grid, len(bands), dtype, nodata,
+                        descriptions, crs) as dst:
+        for k, band in enumerate(bands):
+            dst.write(band.astype(dtype), k + 1)
+
+
+def f_TiledOptions(block=256, predictor=3):
+    '''
+    Function that:
+    - receives the size of the tiles and the predictor (3 for floating
+      point, 2 for integers, 1 for none),
+    - returns the creation options of a tiled GeoTIFF, compressed with
+      deflate + predictor, the compression being done by all the CPUs in
+      parallel threads.
+    '''
+    return({'tiled': True, 'blockxsize': block, 'blockysize': block,
+            'compress': 'deflate', 'predictor': predictor,
+            'num_threads': 'ALL_CPUS',
+            'bigtiff': 'IF_SAFER'})
+
+
+def f_ParquetWriter(FileName, fields):
+    '''
+    Function that:
+    - receives the file name and the names of the columns (all float64),
+    - returns a Parquet writer (pyarrow), to be used with f_WriteParquet and
+      closed by the caller.
+    '''
+    pa = f_Lazy('pyarrow')
+    pq = f_Lazy('pyarrow.parquet')
+    if pa is None or pq is None:
+        raise ImportError('pyarrow is required to write Parquet files.')
+    schema = pa.schema([(field, pa.float64()) for field in fields])
+    return(pq.ParquetWriter(FileName, schema, compression='zstd'))
+
+
+def f_WriteParquet(writer, columns):
+    '''
+    Function that:
+    - receives a Parquet writer and a list of 1D float64 arrays (one per
+      column, same length),
+    - writes them as a row group; the arrays are handed to Arrow without
+      copies (contiguous, no nulls: no-data is NaN).
+    '''
+    pa = f_Lazy('pyarrow')
+    arrays = [pa.array(np.ascontiguousarray(c, dtype=np.float64))
+              for c in columns]
+    writer.write_table(pa.Table.from_arrays(arrays, schema=writer.schema))
+
+
+def f_WriteCSV(FileName, records, fields):
+    '''
+    Function that:
+    - receives the file name, a list of tuples and the names of their fields,
+    - writes them as a CSV file with a header.
+    '''
+    with open(FileName, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        writer.writerows(records)
+
+
+def f_WriteGeoJSON(FileName, records, fields):
+    '''
+    Function that:
+    - receives the file name, a list of tuples and the names of their fields,
+      the first two being lon and lat,
+    - writes them as a GeoJSON file of points.
+    '''
+    features = [{'type': 'Feature',
+                 'geometry': {'type': 'Point', 'coordinates': [rec[0], rec[1]]},
+                 'properties': dict(zip(fields[2:], rec[2:]))}
+                for rec in records]
+    with open(FileName, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f)
+
+
+# %% Functions: correlations.
+def f_LogPair(b1aux, b2aux, off=0.):
+    '''
+    Function that:
+    - receives two arrays of the same shape and an offset,
+    - if off = 0, applies a mask to remove 0 and the negative values in any of
+      the arrays, as f_PearsonLT0 in NL-POP CROSS,
+    - if off > 0, removes only the negative values and keeps the 0s,
+    - returns log10(array + off) for both arrays, NaN where masked.
+    '''
+    if off > 0:
+        b_mask = (b1aux < 0) | (b2aux < 0)
+    else:
+        b_mask = (b1aux <= 0) | (b2aux <= 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        l1 = np.log10(b1aux + off)
+        l2 = np.log10(b2aux + off)
+    l1[b_mask] = np.nan
+    l2[b_mask] = np.nan
+    return(l1, l2)
+
+
+def f_StackPair(stack, pair, iNL, iPD, off=0.):
+    '''
+    Function that:
+    - receives the stack of a chunk with the NL datasets iNL followed by the
+      PD datasets iPD (numbers from 1, as in the scripts), a pair (NL, PD)
+      and the offset of the log,
+    - returns log10(PD + off), log10(NL + off) of the pair (see f_LogPair).
+    '''
+    bNL = stack[iNL.index(pair[0])]
+    bPD = stack[len(iNL) + iPD.index(pair[1])]
+    lNL, lPD = f_LogPair(bNL, bPD, off)
+    return(lPD, lNL)
+
+
+def f_Moments(x, y, wrow=None):
+    '''
+    Function that:
+    - receives two arrays of the same shape (NaN where masked) and optionally
+      the weights of their rows (see f_RowWeights; the arrays are then 2D),
+    - returns the sums n, x, y, x2, y2, xy over the valid pairs, which can be
+      added chunk by chunk; weighted, n is the sum of the weights and the
+      other sums are weighted too (f_LinFit then gives the weighted fit).
+    '''
+    ok = np.isfinite(x) & np.isfinite(y)
+    xv = x[ok]
+    yv = y[ok]
+    if wrow is None:
+        return(np.array([xv.size, xv.sum(), yv.sum(), (xv * xv).sum(),
+                         (yv * yv).sum(), (xv * yv).sum()]))
+    wv = np.broadcast_to(np.reshape(wrow, (-1, 1)), x.shape)[ok]
+    return(np.array([wv.sum(), (wv * xv).sum(), (wv * yv).sum(),
+                     (wv * xv * xv).sum(), (wv * yv * yv).sum(),
+                     (wv * xv * yv).sum()]))
+
+
+def f_ZonalMoments(band, wrow=None, zones=None, nzones=1):
+    '''
+    Function that:
+    - receives a band (rows, w), optionally the weights of its rows (see
+      f_RowWeights) and the zone of each pixel (rows, w; 0 to nzones - 1),
+    - returns an array (nzones, 3) with the sums w, w * v and w * v^2 of the
+      valid pixels (>= 0) of each zone, which can be added chunk by chunk:
+      area (or count) of the zone with data, mean = [1] / [0], etc.
+    '''
+    ok = band >= 0
+    z = np.zeros(ok.sum(), dtype=np.int64) if zones is None else zones[ok]
+    v = band[ok]
+    wv = None if wrow is None else \
+        np.broadcast_to(np.reshape(wrow, (-1, 1)), band.shape)[ok]
+    out = np.empty((nzones, 3))
+    out[:, 0] = np.bincount(z, wv, nzones)
+    out[:, 1] = np.bincount(z, v if wv is None else wv * v, nzones)
+    out[:, 2] = np.bincount(z, v * v if wv is None else wv * v * v, nzones)
+    return(out)
+
+
+def f_LinFit(m):
+    '''
+    Function that:
+    - receives the sums from f_Moments,
+    - fits y = a + b * x by least squares,
+    - returns a, b and the Pearson coefficient.
+    '''
+    n, sx, sy, sxx, syy, sxy = m
+    cxx = sxx - sx * sx / n
+    cyy = syy - sy * sy / n
+    cxy = sxy - sx * sy / n
+    b = cxy / cxx
+    a = (sy - b * sx) / n
+    return(a, b, cxy / np.sqrt(cxx * cyy))
+
+
+def f_Residuals(x, y, fit):
+    '''
+    Function that:
+    - receives two arrays of the same shape and the fit from f_LinFit,
+    - returns the residuals y - (a + b * x), NaN where masked.
+    '''
+    return(y - (fit[0] + fit[1] * x))
+
+
+def f_PearsonLE0(b1faux, b2faux):
+    '''
+    Function that:
+    - receives two flattened arrays of the same shape,
+    - applies a mask to remove the negative values in any of the arrays,
+    - calculates the Pearson correlation coefficient to the masked pair,
+    - returns the coefficient.
+    '''
+    b_mask = np.array(np.array([b1faux, b2faux]).min(axis=0) < 0)
+    return(np.corrcoef(np.delete(b1faux, b_mask),
+                       np.delete(b2faux, b_mask))[0, 1])
+
+
+def f_PearsonLT0(b1faux, b2faux):
+    '''
+    Function that:
+    - receives two flattened arrays of the same shape,
+    - applies a mask to remove 0 and the negative values in any of the arrays,
+    - calculates the LOG-LOG Pearson correlation coefficient to the masked pair,
+    - returns the coefficient.
+    '''
+    b_mask = np.array(np.array([b1faux, b2faux]).min(axis=0) <= 0)
+    return(np.corrcoef(np.log10(np.delete(b1faux, b_mask)),
+                       np.log10(np.delete(b2faux, b_mask)))[0, 1])
+
+
+# %% Functions: moments of all the pairs.
+def f_PairMomentsNumPy(bNL, bPD, rNL, rPD, bins, mom, hist, wrow):
+    '''
+    Function that:
+    - receives the flattened NL bands (nNL, n) and PD bands (nPD, n), the
+      ranges of log10(NL) and log10(PD) of the histograms, their number of
+      bins, the arrays where the results are added:
+      mom (nNL, nPD, 2, 6) and hist (nNL, nPD, bins, bins), and the weights
+      of the rows (the n pixels are len(wrow) rows; ones(1) if unweighted),
+    - for each pair NL x PD, adds the sums n, x, y, x2, y2, xy of the values
+      >= 0 (mom[..., 0, :], as f_PearsonLE0) and of the log10 of the values
+      > 0 (mom[..., 1, :], as f_PearsonLT0), and the counts of the 2D
+      histogram of the log10 values, all of them weighted,
+    - is the NumPy reference of f_PairMomentsNumba.
+    '''
+    shape = (wrow.shape[0], bNL.shape[1] // wrow.shape[0])
+    wb = np.broadcast_to(wrow[:, None], shape)  # a view, no copies
+    sNL = bins / (rNL[1] - rNL[0])
+    sPD = bins / (rPD[1] - rPD[0])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lNL = np.log10(bNL)
+        lPD = np.log10(bPD)
+    for a in range(bNL.shape[0]):
+        x = bNL[a].reshape(shape)
+        lx = lNL[a].reshape(shape)
+        kx = np.floor((lx - rNL[0]) * sNL)
+        kx[lx == rNL[1]] = bins - 1  # right edge included, as np.histogram
+        for b in range(bPD.shape[0]):
+            y = bPD[b].reshape(shape)
+            ly = lPD[b].reshape(shape)
+
+            # Linear, >= 0:
+            ok = (x >= 0) & (y >= 0)
+            xv = x[ok]
+            yv = y[ok]
+            wv = wb[ok]
+            mom[a, b, 0] += [wv.sum(), (wv * xv).sum(), (wv * yv).sum(),
+                             (wv * xv * xv).sum(), (wv * yv * yv).sum(),
+                             (wv * xv * yv).sum()]
+
+            # Log-log, > 0:
+            ok = (x > 0) & (y > 0)
+            xv = lx[ok]
+            yv = ly[ok]
+            wv = wb[ok]
+            mom[a, b, 1] += [wv.sum(), (wv * xv).sum(), (wv * yv).sum(),
+                             (wv * xv * xv).sum(), (wv * yv * yv).sum(),
+                             (wv * xv * yv).sum()]
+
+            # Histogram (counts if unweighted):
+            ky = np.floor((yv - rPD[0]) * sPD)
+            ky[yv == rPD[1]] = bins - 1
+            kxv = kx[ok]
+            ok = (kxv >= 0) & (kxv < bins) & (ky >= 0) & (ky < bins)
+            hw = None if hist.dtype == np.int64 else wv[ok]
+            hist[a, b] += np.bincount(
+                (kxv[ok] * bins + ky[ok]).astype(np.int64), hw,
+                minlength=bins * bins).reshape(bins, bins).astype(hist.dtype)
+
+
+def f_PairMomentsKernel(bNL, bPD, rNL, rPD, bins, mom, hist, wrow):
+    '''
+    Function that:
+    - does the same as f_PairMomentsNumPy, in a single pass over the pixels
+      and without temporary arrays; the weight of a pixel is that of its row
+      (wrow has the dtype of hist: int64 ones if unweighted),
+    - is compiled with numba (see f_PairMomentsNumba).
+    '''
+    nNL = bNL.shape[0]
+    nPD = bPD.shape[0]
+    sNL = bins / (rNL[1] - rNL[0])
+    sPD = bins / (rPD[1] - rPD[0])
+    lx = np.empty(nNL)
+    kx = np.empty(nNL, dtype=np.int64)
+    w = bNL.shape[1] // wrow.shape[0]
+    for p in range(bNL.shape[1]):
+        wt = wrow[p // w]
+        # Log10 and bin of each NL, once per pixel:
+        for a in range(nNL):
+            x = bNL[a, p]
+            if x > 0:
+                lx[a] = np.log10(x)
+                kx[a] = int(np.floor((lx[a] - rNL[0]) * sNL))
+                if lx[a] == rNL[1]:
+                    kx[a] = bins - 1
+        for b in range(nPD):
+            y = bPD[b, p]
+            if y < 0:
+                continue
+            ly = np.log10(y) if y > 0 else 0.
+            ky = int(np.floor((ly - rPD[0]) * sPD))
+            if ly == rPD[1]:
+                ky = bins - 1
+            for a in range(nNL):
+                x = bNL[a, p]
+                if x < 0:
+                    continue
+                m = mom[a, b, 0]
+                m[0] += wt
+                m[1] += wt * x
+                m[2] += wt * y
+                m[3] += wt * x * x
+                m[4] += wt * y * y
+                m[5] += wt * x * y
+                if x > 0 and y > 0:
+                    m = mom[a, b, 1]
+                    m[0] += wt
+                    m[1] += wt * lx[a]
+                    m[2] += wt * ly
+                    m[3] += wt * lx[a] * lx[a]
+                    m[4] += wt * ly * ly
+                    m[5] += wt * lx[a] * ly
+                    if 0 <= kx[a] < bins and 0 <= ky < bins:
+                        hist[a, b, kx[a], ky] += wt
+
+
+def f_PairMomentsNumba():
+    '''
+    Function that:
+    - compiles f_PairMomentsKernel with numba the first time it is called
+      (numba is only imported then; the machine code is cached on disk),
+    - returns the compiled kernel, or None if numba is not available.
+    '''
+    if 'f_PairMomentsKernel' not in _modules:
+        numba = f_Lazy('numba')
+        _modules['f_PairMomentsKernel'] = (
+            None if numba is None else
+            numba.njit(cache=True)(f_PairMomentsKernel))
+    return(_modules['f_PairMomentsKernel'])
+
+
+def f_PairMoments(bNL, bPD, rNL, rPD, bins=100, mom=None, hist=None,
+                  use_numba=True, wrow=None):
+    '''
+    Function that:
+    - receives the flattened NL bands (nNL, n) and PD bands (nPD, n), the
+      ranges of log10(NL) and log10(PD) and the number of bins of the 2D
+      histograms, optionally the results of previous chunks, and optionally
+      the weights of the rows of the chunk (see f_RowWeights; the n pixels
+      are len(wrow) rows),
+    - adds the moments and histograms of all the pairs NL x PD (see
+      f_PairMomentsNumPy), with numba if it is available and use_numba,
+    - returns mom (nNL, nPD, 2, 6) and hist (nNL, nPD, bins, bins): counts
+      (int64), or areas (float64) if weighted; the Pearson coefficients are
+      f_LinFit(mom[a, b, 0])[2] (>= 0) and f_LinFit(mom[a, b, 1])[2]
+      (log-log, > 0).
+    '''
+    bNL = np.ascontiguousarray(bNL, dtype=np.float64)
+    bPD = np.ascontiguousarray(bPD, dtype=np.float64)
+    if wrow is None:
+        wrow = np.ones(1, dtype=np.int64)
+    else:
+        wrow = np.ascontiguousarray(wrow, dtype=np.float64)
+    if bNL.shape[1] % wrow.shape[0]:
+        raise ValueError('The pixels are not a whole number of rows.')
+    if mom is None:
+        mom = np.zeros((bNL.shape[0], bPD.shape[0], 2, 6))
+    if hist is None:
+        hist = np.zeros((bNL.shape[0], bPD.shape[0], bins, bins),
+                        dtype=wrow.dtype)
+    rNL = np.array(rNL, dtype=np.float64)
+    rPD = np.array(rPD, dtype=np.float64)
+    kernel = f_PairMomentsNumba() if use_numba else None
+    if kernel is not None:
+        kernel(bNL, bPD, rNL, rPD, bins, mom, hist, wrow)
+    else:
+        f_PairMomentsNumPy(bNL, bPD, rNL, rPD, bins, mom, hist, wrow)
+    return(mom, hist)
+
+
+def f_HistEdges(r, bins):
+    '''
+    Function that:
+    - receives the range and the number of bins of a histogram,
+    - returns the edges of the bins.
+    '''
+    return(np.linspace(r[0], r[1], bins + 1))
+
+
+# %% Functions: coverage.
+def f_Coverage(stack, counts=None, table=None, mask=None):
+    '''
+    Function that:
+    - receives the aligned rows of n datasets (n, rows, w), optionally the
+      results of previous chunks and the mask of the rows (rows, w) with the
+      pixels to count (e.g. those of a region),
+    - classifies each value as no-data (0, < 0), 0 (1) or positive (2), and
+      each pixel by the joint code sum(class_k * 3^k) of all the datasets,
+    - adds the counts of each class per dataset and the counts of each joint
+      code (contingency table), with a single bincount each,
+    - returns counts (n, 3), table (3^n) and the coverage bitmap of the rows
+      (rows, w): bit k set if dataset k has data (0 out of the mask).
+    '''
+    n = stack.shape[0]
+    cls = (stack >= 0).astype(np.int64) + (stack > 0)
+    if counts is None:
+        counts = np.zeros((n, 3), dtype=np.int64)
+    if table is None:
+        table = np.zeros(3 ** n, dtype=np.int64)
+    bits = np.tensordot(1 << np.arange(n), (cls > 0).astype(np.int64), axes=1)
+    if mask is not None:
+        cls = cls[:, mask]
+        bits[~mask] = 0
+    cls = cls.reshape(n, -1)
+    counts += np.bincount((cls + 3 * np.arange(n)[:, None]).ravel(),
+                          minlength=3 * n).reshape(n, 3)
+    table += np.bincount(np.dot(3 ** np.arange(n), cls), minlength=3 ** n)
+    return(counts, table, bits.astype(np.uint8 if n <= 8 else np.uint16))
+
+
+def f_CoverageCode(code, n):
+    '''
+    Function that:
+    - receives a joint code of f_Coverage and the number of datasets,
+    - returns the classes of each dataset (0 no-data, 1 zero, 2 positive).
+    '''
+    return([(code // 3 ** k) % 3 for k in range(n)])
+
+
+# %% Functions: spatial autocorrelation.
+def f_ReadHalo(ds_list, grid, i0, i1, mask=None):
+    '''
+    Function that:
+    - receives a list of open datasets, a Grid, a range of rows and optionally
+      the mask of a region,
+    - reads the rows plus one row above and one below (the halo), NODATA
+      beyond the edges of the grid,
+    - returns an array (n, i1 - i0 + 2, w).
+    '''
+    stack = np.full((len(ds_list), i1 - i0 + 2, grid.w), NODATA)
+    h0 = max(i0 - 1, 0)
+    h1 = min(i1 + 1, grid.h)
+    stack[:, h0 - i0 + 1:h1 - i0 + 1] = f_ReadStack(ds_list, grid, h0, h1,
+                                                  mask)
+    return(stack)
+
+
+def f_QueenSums(z):
+    '''
+    Function that:
+    - receives an array (rows + 2, w) with a halo row above and below (NaN
+      where masked),
+    - adds the 8 neighbours (queen contiguity) of each pixel with array shifts,
+      the pixels beyond the left and right edges being masked,
+    - returns the sum of the valid neighbours and their number, (rows, w).
+    '''
+    r = z.shape[0] - 2
+    w = z.shape[1]
+    v = np.pad(np.isfinite(z), ((0, 0), (1, 1)), 'constant')
+    zp = np.pad(np.where(np.isfinite(z), z, 0.), ((0, 0), (1, 1)), 'constant')
+    s = np.zeros((r, w))
+    k = np.zeros((r, w))
+    for di in range(3):
+        for dj in range(3):
+            if di == 1 and dj == 1:
+                continue
+            s += zp[di:di + r, dj:dj + w]
+            k += v[di:di + r, dj:dj + w]
+    return(s, k)
+
+
+def f_MoranGlobal(N, szs, szz, S0, Sk2):
+    '''
+    Function that:
+    - receives the number of valid pixels N, the sums of z_i * lag_i, z_i2,
+      the number of links S0 = sum(k_i) and sum(k_i2), for binary queen weights,
+    - returns Moran's I, its expected value and its z-score (normality).
+    '''
+    I = N / S0 * szs / szz
+    E = -1. / (N - 1)
+    S1 = 2. * S0
+    S2 = 4. * Sk2
+    V = (N * N * S1 - N * S2 + 3. * S0 * S0) / ((N * N - 1.) * S0 * S0) - E * E
+    return(I, E, (I - E) / np.sqrt(V))
+
+
+def f_Lisa(z, s, k, N, m2, m4, z_crit=1.96):
+    '''
+    Function that:
+    - receives the centred values z (NaN where masked), the sums and numbers
+      of valid neighbours from f_QueenSums, N and the moments m2, m4 of z,
+    - computes the local Moran's I with row-standardised weights and its
+      z-score (randomisation, Anselin 1995),
+    - returns the local I, the z-score and the cluster: 0 = not significant,
+      1 = high-high, 2 = low-low, 3 = high-low, 4 = low-high.
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lag = s / k
+        Ii = z * lag / m2
+        b2 = m4 / (m2 * m2)
+        w2 = 1. / k
+        wkh = 1. - 1. / k
+        E = -1. / (N - 1)
+        V = (w2 * (N - b2) / (N - 1) + wkh * (2. * b2 - N) / ((N - 1) * (N - 2))
+             - E * E)
+        zI = (Ii - E) / np.sqrt(V)
+    ok = np.isfinite(zI) & (k > 0)
+    sig = ok & (np.abs(zI) >= z_crit)
+    clus = np.zeros(z.shape, dtype=np.uint8)
+    clus[sig & (z > 0) & (lag > 0)] = 1
+    clus[sig & (z < 0) & (lag < 0)] = 2
+    clus[sig & (z > 0) & (lag < 0)] = 3
+    clus[sig & (z < 0) & (lag > 0)] = 4
+    Ii[~ok] = np.nan
+    zI[~ok] = np.nan
+    return(Ii, zI, clus)
+
+
+# %% Functions: top-k.
+def f_TopK(values, k):
+    '''
+    Function that:
+    - receives an array (NaN where masked) and k,
+    - selects the k largest values with np.argpartition, in O(n),
+    - returns their flat indices (unsorted).
+    '''
+    v = np.where(np.isfinite(values), values, -np.inf).ravel()
+    n_ok = int(np.isfinite(values).sum())
+    if n_ok == 0:
+        return(np.array([], dtype=np.int64))
+    k = min(k, n_ok)
+    idx = np.argpartition(v, v.size - k)[v.size - k:]
+    return(idx[np.isfinite(v[idx])])
+
+
+def f_HeapMerge(heap, keys, items, k):
+    '''
+    Function that:
+    - receives a min-heap of (key, item) of at most k entries, and new keys
+      and items,
+    - keeps the k entries with the largest keys, in O(k) memory,
+    - returns the heap.
+    '''
+    for key, item in zip(keys, items):
+        if len(heap) < k:
+            heapq.heappush(heap, (key, item))
+        elif key > heap[0][0]:
+            heapq.heapreplace(heap, (key, item))
+    return(heap)
+
+
+# %% Functions: time series.
+def f_TrendMoments(stack, years):
+    '''
+    Function that:
+    - receives a stack (T, rows, w) of yearly values and the T years,
+    - removes the no-data (< 0) pixel by pixel,
+    - returns the cumulative sums over the time axis of the valid count and
+      of t, t2, y, ty, y2 (t in years since the first year), each (T, rows, w).
+    '''
+    t = (np.asarray(years, dtype=np.float64) - years[0])[:, None, None]
+    v = stack >= 0
+    y = np.where(v, stack, 0.)
+    vt = v * t
+    return([np.cumsum(a, axis=0) for a in
+            (v.astype(np.float64), vt, vt * t, y, y * t, y * y)])
+
+
+def f_TrendFit(n, St, Stt, Sy, Sty, Syy):
+    '''
+    Function that:
+    - receives the sums of the valid count and of t, t2, y, ty, y2,
+    - applies the closed-form least squares fit y = a + b * t,
+    - returns the slope b, the intercept a, R2 and the residual sum of
+      squares; NaN where the fit is not defined (n < 2 or constant t), and
+      R2 NaN also for a constant y (no variance to explain).
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Stt_c = Stt - St * St / n
+        Sty_c = Sty - St * Sy / n
+        Syy_c = Syy - Sy * Sy / n
+        slope = Sty_c / Stt_c
+        intercept = (Sy - slope * St) / n
+        R2 = Sty_c * Sty_c / (Stt_c * Syy_c)
+        SSE = np.maximum(Syy_c - slope * Sty_c, 0.)
+    bad = (n < 2) | (Stt_c <= 0)
+    slope[bad] = np.nan
+    intercept[bad] = np.nan
+    R2[bad] = np.nan
+    R2[Syy_c <= 1e-12 * np.abs(Syy)] = np.nan  # constant y, with rounding
+    SSE[bad] = np.nan
+    return(slope, intercept, R2, SSE)
+
+
+def f_ChangePoint(cums, years, seg_min=3):
+    '''
+    Function that:
+    - receives the cumulative sums from f_TrendMoments and the years,
+    - for each candidate break year, fits one line before and one after,
+    - compares them to the single line with an F statistic (2, n - 4 dof),
+    - returns the best F and the first year of the second segment (0 if
+      there is no valid candidate).
+    '''
+    T = len(years)
+    tot = [c[-1] for c in cums]
+    SSE0 = f_TrendFit(*tot)[3]
+    F_best = np.zeros(SSE0.shape)
+    y_best = np.zeros(SSE0.shape)
+    for k in range(seg_min, T - seg_min + 1):
+        # Segments [0, k) and [k, T):
+        s1 = [c[k - 1] for c in cums]
+        s2 = [a - b for a, b in zip(tot, s1)]
+        SSEk = f_TrendFit(*s1)[3] + f_TrendFit(*s2)[3]
+        dof = tot[0] - 4
+        with np.errstate(divide='ignore', invalid='ignore'):
+            F = ((SSE0 - SSEk) / 2) / (SSEk / dof)
+        F[np.isnan(F) | (dof < 1) | (s1[0] < 2) | (s2[0] < 2)] = 0.
+        better = F > F_best
+        F_best[better] = F[better]
+        y_best[better] = years[k]
+    return(F_best, y_best)
+
+
+# %% Functions: batches.
+_datasets = {}           # open datasets of this process, by file name
+_tiles = OrderedDict()   # tiles of the grids read by this process
+TileCacheSize = 256      # max. number of tiles kept (256 x 256 x 8 bytes each)
+TileStats = {'hits': 0, 'reads': 0}
+
+
+def f_OpenCached(FileName):
+    '''
+    Function that:
+    - receives a file name,
+    - opens the dataset only the first time in this process,
+    - returns the open dataset.
+    '''
+    if FileName not in _datasets:
+        _datasets[FileName] = rasterio.open(FileName)
+    return(_datasets[FileName])
+
+
+def f_CloseCached():
+    '''
+    Function that:
+    - closes the datasets opened by f_OpenCached in this process and empties
+      the cache of tiles.
+    '''
+    for ds in _datasets.values():
+        ds.close()
+    _datasets.clear()
+    _tiles.clear()
+
+
+def f_GridOffset(grid, sub):
+    '''
+    Function that:
+    - receives a Grid and a part of it (see f_RegionGrid),
+    - returns the row and column of the Grid where the part starts.
+    '''
+    return(sub.oi - grid.oi, sub.oj - grid.oj)
+
+
+def f_ReadTile(FileName, grid, ti, tj, tile=256):
+    '''
+    Function that:
+    - receives a file name, a Grid and the row and column of a tile
+      of the grid (tile x tile pixels),
+    - reads the tile aligned to the grid, only if it is not in the cache of
+      tiles of this process (the regions that overlap, or the jobs that use
+      the same files, share the tiles),
+    - returns the tile.
+    '''
+    key = (FileName, tuple(grid), ti, tj, tile)
+    if key in _tiles:
+        _tiles.move_to_end(key)
+        TileStats['hits'] += 1
+        return(_tiles[key])
+
+    i0 = ti * tile
+    i1 = min(i0 + tile, grid.h)
+    j0 = tj * tile
+    sub = grid._replace(oj=grid.oj + j0, w=min(tile, grid.w - j0))
+    data = f_ReadRows(f_OpenCached(FileName), sub, i0, i1)
+    TileStats['reads'] += 1
+    _tiles[key] = data
+    if len(_tiles) > TileCacheSize:
+        _tiles.popitem(last=False)
+    return(data)
+
+
+def f_ReadStackTiled(FileNames, grid, sub, i0, i1, mask=None, tile=256):
+    '''
+    Function that:
+    - receives a list of file names, a Grid, a part of it (region),
+      a range of rows of the part and its mask (or None),
+    - reads the rows tile by tile (see f_ReadTile), skipping the tiles out of
+      the mask,
+    - returns an array (n, i1 - i0, sub.w), as f_ReadStack.
+    '''
+    stack = np.full((len(FileNames), i1 - i0, sub.w), NODATA)
+    oi, oj = f_GridOffset(grid, sub)
+    gi0, gi1 = oi + i0, oi + i1
+    gj0, gj1 = oj, oj + sub.w
+    for ti in range(gi0 // tile, (gi1 - 1) // tile + 1):
+        for tj in range(gj0 // tile, (gj1 - 1) // tile + 1):
+            # Intersection of the tile and the rows, in the grid:
+            a0, a1 = max(ti * tile, gi0), min((ti + 1) * tile, gi1)
+            c0, c1 = max(tj * tile, gj0), min((tj + 1) * tile, gj1)
+            if mask is not None and not mask[a0 - oi:a1 - oi, c0 - oj:c1 - oj].any():
+                continue
+            for k, FileName in enumerate(FileNames):
+                data = f_ReadTile(FileName, grid, ti, tj, tile)
+                stack[k, a0 - gi0:a1 - gi0, c0 - gj0:c1 - gj0] = \
+                    data[a0 - ti * tile:a1 - ti * tile, c0 - tj * tile:c1 - tj * tile]
+    if mask is not None:
+        stack[:, ~mask[i0:i1]] = NODATA
+    return(stack)
+
+
+def f_LoadConfig(FileName):
+    '''
+    Function that:
+    - receives the name of a configuration file (.json; .yaml / .yml with
+      PyYAML; .toml with tomllib or toml),
+    - returns its content as a dict.
+    '''
+    ext = os.path.splitext(FileName)[1].lower()
+    if ext in ('.yaml', '.yml'):
+        import yaml
+        with open(FileName) as f:
+            return(yaml.safe_load(f))
+    if ext == '.toml':
+        try:
+            import tomllib
+        except ImportError:
+            import toml
+            return(toml.load(FileName))
+        with open(FileName, 'rb') as f:
+            return(tomllib.load(f))
+    with open(FileName) as f:
+        return(json.load(f))
+
+
+def f_InitBatchWorker(tile_cache=256):
+    '''
+    Function that:
+    - receives the max. number of tiles kept by each process,
+    - initializes a process of the pool of f_BatchJob.
+    '''
+    global TileCacheSize
+    TileCacheSize = tile_cache
+
+
+def f_BatchJob(job):
+    '''
+    Function that:
+    - receives a job (dict) with the region (name, GeoJSON file or None), the
+      NL and PD file names, the pairs (NL, PD) to compute, their Grid (see
+      f_PairGrids), the ranges and bins of the heatmaps, the rows per chunk
+      and the cache folder,
+    - reads the region chunk by chunk, tile by tile (shared with other jobs of
+      this process) and computes the moments and heatmaps of the pairs,
+    - returns a dict with the region, the results [(NL, PD, mom, hist)], the
+      number of pixels and the time used.
+    '''
+    t0 = time.time()
+    grid = job['grid']
+    sub, mask = f_Region(job['FileNameRegion'], grid, job['CacheDir'])
+    iNL = sorted(set(p[0] for p in job['pairs']))
+    iPD = sorted(set(p[1] for p in job['pairs']))
+    FileNames = ([job['FileNamesNL'][a] for a in iNL] +
+                 [job['FileNamesPD'][b] for b in iPD])
+    mom = None
+    hist = None
+    for i0, i1 in f_Chunks(sub.h, job['ChunkRows']):
+        stack = f_ReadStackTiled(FileNames, grid, sub, i0, i1, mask)
+        stack = stack.reshape(len(FileNames), -1)
+        mom, hist = f_PairMoments(stack[:len(iNL)], stack[len(iNL):],
+                                  job['RangeNL'], job['RangePD'], job['Bins'],
+                                  mom, hist)
+    results = [(a, b, mom[k, m], hist[k, m])
+               for k, a in enumerate(iNL) for m, b in enumerate(iPD)
+               if (a, b) in job['pairs']]
+    pixels = sub.h * sub.w if mask is None else int(mask.sum())
+    return({'region': job['region'], 'results': results, 'pixels': pixels,
+            'seconds': time.time() - t0, 'pid': os.getpid(),
+            'tiles': dict(TileStats)})
+
+
+def f_BatchJobs(jobs):
+    '''
+    Function that:
+    - receives a list of jobs (e.g. those of a region),
+    - runs them one after the other in the same process, sharing the open
+      datasets and the tiles,
+    - returns the list of their results (see f_BatchJob).
+    '''
+    return([f_BatchJob(job) for job in jobs])
+
+
+# %% Functions: profiling.
+# Disabled (None) unless f_ProfileStart is called: f_StageStart and
+# f_StageEnd then cost a test of Profile and nothing else. When enabled, a
+# stage costs about 2 us (two clock and two getrusage calls), the trace
+# events being built only when they are written.
+Profile = None
+
+
+def f_ProfileStart():
+    '''
+    Function that:
+    - enables the profiling of the stages (see f_StageStart) in this process,
+      discarding the stages recorded before.
+    '''
+    global Profile
+    Profile = {'t0': time.perf_counter(), 'pid': os.getpid(), 'stages': []}
+
+
+def f_ProfileStop():
+    '''
+    Function that:
+    - disables the profiling of the stages,
+    - returns the stages recorded, as trace events (see f_ProfileEvents).
+    '''
+    global Profile
+    events = f_ProfileEvents()
+    Profile = None
+    return(events)
+
+
+def f_Usage():
+    '''
+    Function that:
+    - returns the CPU time (s) and the peak resident memory (MB) of this
+      process; without the module resource (Windows), the peak memory is 0.
+    '''
+    if resource is None:
+        return(time.process_time(), 0.)
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    rss = ru.ru_maxrss / 2. ** (20 if sys.platform == 'darwin' else 10)
+    return(ru.ru_utime + ru.ru_stime, rss)
+
+
+def f_StageStart(name):
+    '''
+    Function that:
+    - receives the name of a stage (open, preflight, read, align, mask,
+      correlate, histogram, render...),
+    - returns the start of the stage, to be passed to f_StageEnd (None if the
+      profiling is disabled).
+    '''
+    if Profile is None:
+        return(None)
+    return(name, time.perf_counter(), f_Usage()[0])
+
+
+def f_StageEnd(st, pixels=0, nbytes=0):
+    '''
+    Function that:
+    - receives the start of a stage (see f_StageStart), the pixels processed
+      and the bytes read by it,
+    - records the wall and CPU time, the bytes, the pixels and the peak
+      memory of the stage; stages can be nested.
+    '''
+    if st is None or Profile is None:
+        return
+    t1 = time.perf_counter()
+    cpu, rss = f_Usage()
+    Profile['stages'].append((st[0], st[1], t1, cpu - st[2], pixels, nbytes,
+                              rss))
+
+
+def f_ProfileEvents():
+    '''
+    Function that:
+    - returns the stages recorded so far as trace events (complete events,
+      times in us, the rest in args).
+    '''
+    if Profile is None:
+        return([])
+    t0 = Profile['t0']
+    pid = Profile['pid']
+    return([{'name': name, 'cat': 'stage', 'ph': 'X', 'pid': pid, 'tid': 0,
+             'ts': (ta - t0) * 1e6, 'dur': (tb - ta) * 1e6,
+             'args': {'cpu_ms': cpu * 1e3, 'bytes': int(nbytes),
+                      'pixels': int(pixels), 'peak_rss_mb': rss}}
+            for name, ta, tb, cpu, pixels, nbytes, rss in Profile['stages']])
+
+
+def f_ProfileSummary(events=None):
+    '''
+    Function that:
+    - receives a list of trace events (the stages recorded so far if None),
+    - adds them up by stage, in order of first appearance,
+    - returns a dict stage -> {calls, wall_s, cpu_s, bytes, pixels,
+      peak_rss_mb}.
+    '''
+    if events is None:
+        events = f_ProfileEvents()
+    summary = OrderedDict()
+    for e in events:
+        s = summary.setdefault(e['name'], {'calls': 0, 'wall_s': 0.,
+                                           'cpu_s': 0., 'bytes': 0,
+                                           'pixels': 0, 'peak_rss_mb': 0.})
+        s['calls'] += 1
+        s['wall_s'] += e['dur'] / 1e6
+        s['cpu_s'] += e['args']['cpu_ms'] / 1e3
+        s['bytes'] += e['args']['bytes']
+        s['pixels'] += e['args']['pixels']
+        s['peak_rss_mb'] = max(s['peak_rss_mb'], e['args']['peak_rss_mb'])
+    return(summary)
+
+
+def f_ProfileWrite(FileName, events=None):
+    '''
+    Function that:
+    - receives the name of the output file and a list of trace events (the
+      stages recorded so far if None),
+    - writes them as a trace-event JSON file, to be opened with
+      chrome://tracing or https://ui.perfetto.dev, with the summary by
+      stage in otherData.
+    '''
+    if events is None:
+        events = f_ProfileEvents()
+    with open(FileName, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                   'otherData': {'stages': f_ProfileSummary(events)}}, f)
+
+
+def f_ProfileReport(FileName):
+    '''
+    Function that:
+    - receives the name of the output file (trace-event JSON),
+    - prints the summary of the stages recorded so far and writes them (see
+      f_ProfileWrite).
+    '''
+    print('Stages:')
+    for name, sp in f_ProfileSummary().items():
+        print('{:10s} {:5d} calls, wall {:7.2f} s, CPU {:7.2f} s, {:8.1f} MB read, {:11d} pixels, peak {:7.1f} MB.'.format(
+            name, sp['calls'], sp['wall_s'], sp['cpu_s'], sp['bytes'] / 2. ** 20,
+            sp['pixels'], sp['peak_rss_mb']))
+    f_ProfileWrite(FileName)
+    print('Profile: {:s}'.format(FileName))